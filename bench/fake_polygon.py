@@ -0,0 +1,194 @@
+#! /usr/bin/python
+
+# a local stand-in for the part of the Polygon API that cms2pg uses. it accepts any key and
+# signature, keeps nothing but counters and answers like Polygon does. run it directly to use
+# it by hand (cms2pg --api-url http://127.0.0.1:8765/), or use start_server() from a script
+
+import argparse
+import email.parser
+import email.policy
+import json
+import random
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl
+
+
+class FakePolygonState:
+    def __init__(self, latency: float = 0.0, failure_rate: float = 0.0):
+        # seconds added to every request, to resemble a real round trip
+        self.latency = latency
+        # fraction of requests answered with an HTTP 503 error page
+        self.failure_rate = failure_rate
+        self.calls = Counter()
+        self.bytes_received = Counter()
+        self.failures = Counter()
+        self.connections = 0
+        self.problems = {}  # name -> id
+        self.solutions = {}  # problem id -> {name: tag}
+        self._lock = threading.Lock()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "calls": dict(self.calls),
+                "bytes_received": dict(self.bytes_received),
+                "failures": dict(self.failures),
+                "connections": self.connections,
+                "total_calls": sum(self.calls.values()),
+                "total_bytes_received": sum(self.bytes_received.values()),
+            }
+
+    def reset(self):
+        with self._lock:
+            self.calls.clear()
+            self.bytes_received.clear()
+            self.failures.clear()
+            self.connections = 0
+            self.problems.clear()
+            self.solutions.clear()
+
+    def handle(self, method: str, params: dict):
+        with self._lock:
+            if method == "problem.create":
+                name = params.get("name")
+                if name in self.problems:
+                    return None, "name: You already have such problem"
+                self.problems[name] = len(self.problems) + 1
+                return _problem_json(self.problems[name], name), None
+            elif method == "problems.list":
+                return [_problem_json(problem_id, name) for name, problem_id in self.problems.items()
+                        if params.get("name") in [None, name]], None
+            elif method == "problem.solutions":
+                solutions = self.solutions.get(params.get("problemId"), {})
+                return [{"name": name, "modificationTimeSeconds": 0, "length": 0, "sourceType": "cpp.g++17",
+                         "tag": tag} for name, tag in solutions.items()], None
+            elif method == "problem.saveSolution":
+                self.solutions.setdefault(params.get("problemId"), {})[params.get("name")] = params.get("tag")
+                return None, None
+            elif method in SUPPORTED_METHODS:
+                return None, None
+            else:
+                return None, "unsupported method %s" % method
+
+
+# methods answered with a plain OK
+SUPPORTED_METHODS = {
+    "problem.updateInfo",
+    "problem.saveTest",
+    "problem.saveTestGroup",
+    "problem.saveFile",
+    "problem.saveScript",
+    "problem.setChecker",
+    "problem.saveStatement",
+    "problem.saveStatementResource",
+    "problem.commitChanges",
+    "problem.buildPackage",
+}
+
+
+def _problem_json(problem_id: int, name: str) -> dict:
+    return {"id": problem_id, "owner": "bench", "name": name, "deleted": False, "favourite": False,
+            "accessType": "OWNER", "revision": 1, "modified": False}
+
+
+class FakePolygonHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, like the real server
+    # headers and body are written separately, which Nagle's algorithm delays on kept-alive connections
+    disable_nagle_algorithm = True
+    state: FakePolygonState = None
+
+    def setup(self):
+        super().setup()
+        with self.state._lock:
+            self.state.connections += 1
+
+    def do_GET(self):
+        if self.path.rstrip("/").endswith("/stats"):
+            self._send_json(200, self.state.stats())
+        else:
+            self._send_json(404, {"status": "FAILED", "comment": "not found"})
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        body = self.rfile.read(length)
+        method = self.path.rstrip("/").split("/")[-1].split("?")[0]
+        params = _parse_params(self.headers.get("Content-Type", ""), body)
+        params.update(dict(parse_qsl(self.path.split("?", 1)[1])) if "?" in self.path else {})
+
+        with self.state._lock:
+            self.state.calls[method] += 1
+            self.state.bytes_received[method] += length
+
+        if self.state.latency > 0:
+            time.sleep(self.state.latency)
+
+        if random.random() < self.state.failure_rate:
+            with self.state._lock:
+                self.state.failures[method] += 1
+            self._send(503, "text/html", b"<html><body>503 Service Temporarily Unavailable</body></html>")
+            return
+
+        result, error = self.state.handle(method, params)
+        if error is not None:
+            self._send_json(400, {"status": "FAILED", "comment": error})
+        elif result is None:
+            self._send_json(200, {"status": "OK"})
+        else:
+            self._send_json(200, {"status": "OK", "result": result})
+
+    def _send_json(self, code: int, data):
+        self._send(code, "application/json", json.dumps(data).encode())
+
+    def _send(self, code: int, content_type: str, payload: bytes):
+        self.send_response(code)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+
+# form fields of a request, as strings (file contents are decoded leniently, they're not used)
+def _parse_params(content_type: str, body: bytes) -> dict:
+    if content_type.startswith("multipart/form-data"):
+        message = email.parser.BytesParser(policy=email.policy.HTTP).parsebytes(
+            b"Content-Type: " + content_type.encode() + b"\r\n\r\n" + body)
+        params = {}
+        for part in message.iter_parts():
+            name = part.get_param("name", header="content-disposition")
+            params[name] = part.get_payload(decode=True).decode(errors="replace")
+        return params
+    return dict(parse_qsl(body.decode(errors="replace")))
+
+
+# starts the server in a background thread. returns (server, state); the API url is
+# http://127.0.0.1:[server.server_port]/
+def start_server(port: int = 0, latency: float = 0.0, failure_rate: float = 0.0):
+    state = FakePolygonState(latency, failure_rate)
+    handler = type("BoundFakePolygonHandler", (FakePolygonHandler,), {"state": state})
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, state
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a fake Polygon API server.")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every request")
+    parser.add_argument("--failure-rate", type=float, default=0.0,
+                        help="fraction of requests that fail with HTTP 503")
+    args = parser.parse_args()
+
+    server, state = start_server(args.port, args.latency, args.failure_rate)
+    print("Fake Polygon API at http://127.0.0.1:%s/, statistics at /stats. Ctrl-C to stop." % server.server_port)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        print(json.dumps(state.stats(), indent=2))
@@ -0,0 +1,147 @@
+#! /usr/bin/python
+
+# measures an end-to-end export of a synthetic task against the fake Polygon server:
+# wall time, CPU time and peak memory of the cms2pg process, and the API calls it made.
+#
+#   python bench/run_benchmark.py --tests 300 --test-size 100000 --latency 0.05 -- --upload-workers 8
+#
+# everything after -- is passed to cms2pg. the task, answers and fake credentials live in a
+# temporary directory, so nothing outside it is touched
+
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import fake_polygon
+import synthetic_task
+
+CMS2PG = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "cms2pg.py")
+
+ANSWERS = """task_info_correct: yes
+overwrite_existing: yes
+tests_prepared: yes
+existing_solution_removed: yes
+solution: sol/sol.cpp
+validate_solution: %s
+proceed_after_failed_validation: no
+statements_checked: yes
+"""
+
+
+# runs cms2pg once in task_dir and returns its measurements
+def run_export(task_dir: str, home_dir: str, api_url: str, answers_path: str, extra_args, log_path: str) -> dict:
+    args = [sys.executable, CMS2PG, "--api-url", api_url, "--answers", answers_path, "--unattended"] + extra_args
+    env = dict(os.environ, HOME=home_dir)
+    start = time.monotonic()
+    with open(log_path, "w") as log_stream:
+        process = subprocess.Popen(args, cwd=task_dir, env=env, stdin=subprocess.DEVNULL,
+                                   stdout=log_stream, stderr=subprocess.STDOUT)
+        # wait4 gives the resource usage of this child alone
+        _, status, rusage = os.wait4(process.pid, 0)
+        process.returncode = os.waitstatus_to_exitcode(status)
+    wall = time.monotonic() - start
+
+    return {
+        "returncode": process.returncode,
+        "wall_seconds": round(wall, 4),
+        "user_seconds": round(rusage.ru_utime, 4),
+        "system_seconds": round(rusage.ru_stime, 4),
+        "peak_rss_kb": rusage.ru_maxrss,
+    }
+
+
+def main():
+    argv = sys.argv[1:]
+    extra_args = []
+    if "--" in argv:
+        extra_args = argv[argv.index("--") + 1:]
+        argv = argv[:argv.index("--")]
+
+    parser = argparse.ArgumentParser(description="Benchmark cms2pg against a local fake Polygon server.")
+    parser.add_argument("--tests", type=int, default=50)
+    parser.add_argument("--test-size", type=int, default=10000, help="bytes per input file")
+    parser.add_argument("--groups", type=int, default=5)
+    parser.add_argument("--figures", type=int, default=2)
+    parser.add_argument("--figure-size", type=int, default=64)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=3, help="number of measured runs")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds the fake server adds to every call")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="fraction of calls failing with HTTP 503")
+    parser.add_argument("--validate", action="store_true", help="also validate the solution")
+    parser.add_argument("--incremental", action="store_true",
+                        help="measure re-exports of an unchanged task instead of fresh exports")
+    parser.add_argument("--output", metavar="FILE", help="write the results as JSON to FILE")
+    parser.add_argument("--keep", action="store_true", help="don't delete the temporary directory")
+    args = parser.parse_args(argv)
+
+    work_dir = tempfile.mkdtemp(prefix="cms2pg-bench-")
+    try:
+        contest_dir = os.path.join(work_dir, "bench-contest")
+        task_dir = synthetic_task.generate_task(contest_dir, tests=args.tests, test_size=args.test_size,
+                                                groups=args.groups, figures=args.figures,
+                                                figure_size=args.figure_size, seed=args.seed)
+
+        home_dir = os.path.join(work_dir, "home")
+        os.makedirs(os.path.join(home_dir, ".cms2pg"))
+        with open(os.path.join(home_dir, ".cms2pg", "auth.json"), "w") as auth_stream:
+            json.dump({"key": "bench", "secret": "bench"}, auth_stream)
+
+        answers_path = os.path.join(work_dir, "answers.yaml")
+        with open(answers_path, "w") as answers_stream:
+            answers_stream.write(ANSWERS % ("yes" if args.validate else "no"))
+
+        server, state = fake_polygon.start_server(latency=args.latency, failure_rate=args.failure_rate)
+        api_url = "http://127.0.0.1:%s/" % server.server_port
+
+        if args.incremental:
+            print("Warm-up export...")
+            run_export(task_dir, home_dir, api_url, answers_path, extra_args, os.path.join(work_dir, "warmup.log"))
+
+        runs = []
+        for i in range(args.repeat):
+            if not args.incremental:
+                # a fresh problem on a fresh server, without manifest or checkpoint
+                shutil.rmtree(os.path.join(task_dir, "polygon"), ignore_errors=True)
+                state.reset()
+            else:
+                state.calls.clear()
+                state.bytes_received.clear()
+
+            log_path = os.path.join(work_dir, "run%s.log" % i)
+            result = run_export(task_dir, home_dir, api_url, answers_path, extra_args, log_path)
+            result["api"] = state.stats()
+            runs.append(result)
+            print("run %s: %.2f s wall, %.2f s CPU, %s KB peak RSS, %s API calls, %s bytes sent%s" %
+                  (i, result["wall_seconds"], result["user_seconds"] + result["system_seconds"],
+                   result["peak_rss_kb"], result["api"]["total_calls"], result["api"]["total_bytes_received"],
+                   "" if result["returncode"] == 0 else " (FAILED, see %s)" % log_path))
+
+        server.shutdown()
+
+        report = {
+            "config": vars(args),
+            "cms2pg_args": extra_args,
+            "runs": runs,
+            "median": {key: statistics.median(run[key] for run in runs)
+                       for key in ["wall_seconds", "user_seconds", "system_seconds", "peak_rss_kb"]},
+        }
+        print("median: %.2f s wall, %s KB peak RSS" % (report["median"]["wall_seconds"],
+                                                        report["median"]["peak_rss_kb"]))
+        if args.output is not None:
+            with open(args.output, "w") as output_stream:
+                json.dump(report, output_stream, indent=2)
+    finally:
+        if args.keep:
+            print("Files kept in %s." % work_dir)
+        else:
+            shutil.rmtree(work_dir)
+
+
+if __name__ == "__main__":
+    main()
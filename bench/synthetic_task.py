@@ -0,0 +1,131 @@
+#! /usr/bin/python
+
+# generates a CMS task in our format with a configurable number and size of tests and
+# figures, for benchmarking. the same arguments always give the same files
+
+import argparse
+import os
+import random
+import struct
+import zlib
+from pathlib import Path
+
+SOLUTION = """#include <iostream>
+#include <string>
+
+int main() {
+  std::ios::sync_with_stdio(false);
+  std::string line;
+  while (std::getline(std::cin, line)) {
+    std::cout << line.size() << '\\n';
+  }
+}
+"""
+
+
+# writes a task under contest_dir/name and returns its directory. tests are split evenly
+# into groups (the first group holds the examples and is worth 0 points), every input has
+# lines of random letters of about test_size bytes in total
+def generate_task(contest_dir: str, name: str = "synth", tests: int = 50, test_size: int = 10000,
+                  groups: int = 5, examples: int = 2, figures: int = 2, figure_size: int = 64,
+                  seed: int = 0) -> str:
+    rng = random.Random(seed)
+    task_dir = os.path.join(contest_dir, name)
+    for sub in ["gen", "input", "output", "sol", "statement"]:
+        Path(task_dir, sub).mkdir(parents=True, exist_ok=True)
+
+    with open(os.path.join(task_dir, "task.yaml"), "w") as yaml_stream:
+        yaml_stream.write("name: %s\ntitle: Synthetic %s\nscore_type: GroupSum\ninfile: ''\noutfile: ''\n"
+                          "time_limit: 1.0\nmemory_limit: 256\n" % (name, name))
+
+    with open(os.path.join(task_dir, "sol", "sol.cpp"), "w") as solution_stream:
+        solution_stream.write(SOLUTION)
+
+    examples = min(examples, tests)
+    test_groups = [examples] + _split(tests - examples, groups)
+    points = _split(100, len(test_groups) - 1)
+    test_id = 0
+    with open(os.path.join(task_dir, "gen", "GEN"), "w") as gen_stream:
+        for group, group_tests in enumerate(test_groups):
+            gen_stream.write("# ST: %s\n" % (0 if group == 0 else points[group - 1]))
+            for _ in range(group_tests):
+                gen_stream.write("gen %s\n" % test_id)
+                _write_test(task_dir, test_id, test_size, rng)
+                test_id += 1
+
+    figure_names = []
+    for figure in range(figures):
+        figure_names.append("fig%s.png" % figure)
+        with open(os.path.join(task_dir, "statement", figure_names[-1]), "wb") as figure_stream:
+            figure_stream.write(_png(figure_size, rng))
+
+    with open(os.path.join(task_dir, "statement", "statement.et.tex"), "w") as statement_stream:
+        statement_stream.write(_statement(name, figure_names, examples, rng))
+
+    return task_dir
+
+
+def _split(total: int, parts: int):
+    if parts <= 0:
+        return []
+    return [total // parts + (1 if i < total % parts else 0) for i in range(parts)]
+
+
+def _write_test(task_dir: str, test_id: int, size: int, rng: random.Random):
+    lines = []
+    written = 0
+    while written < size:
+        line = "".join(rng.choice("abcdefghijklmnopqrstuvwxyz") for _ in range(rng.randint(1, 80)))
+        lines.append(line)
+        written += len(line) + 1
+
+    with open(os.path.join(task_dir, "input", "input%s.txt" % test_id), "w") as input_stream:
+        input_stream.write("".join(line + "\n" for line in lines))
+    with open(os.path.join(task_dir, "output", "output%s.txt" % test_id), "w") as output_stream:
+        output_stream.write("".join("%s\n" % len(line) for line in lines))
+
+
+# a side x side grayscale PNG of noise
+def _png(side: int, rng: random.Random) -> bytes:
+    def chunk(kind: bytes, data: bytes) -> bytes:
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+    rows = b"".join(b"\x00" + bytes(rng.randrange(256) for _ in range(side)) for _ in range(side))
+    return b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", struct.pack(">IIBBBBB", side, side, 8, 0, 0, 0, 0)) + \
+        chunk(b"IDAT", zlib.compress(rows)) + chunk(b"IEND", b"")
+
+
+def _statement(name: str, figure_names, examples: int, rng: random.Random) -> str:
+    words = ["massiiv", "arv", "rida", "sisend", "väljund", "lahendus", "test", "graaf", "tipp", "serv"]
+
+    def paragraph():
+        return " ".join(rng.choice(words) for _ in range(60)) + "\n\n"
+
+    statement = "\\begin{yl}{1}{Synthetic %s}{%s}{1 s}{100 p}\n\n" % (name, name)
+    statement += paragraph() + paragraph()
+    for figure_name in figure_names:
+        statement += "\\begin{figure}[h]\\includegraphics{%s}\\end{figure}\n\n" % figure_name
+        statement += paragraph()
+    statement += "\\sis\n\n" + paragraph()
+    statement += "\\val\n\n" + paragraph()
+    for example in range(examples):
+        statement += "\\nde{%s}\n\n" % example
+    statement += "\\end{yl}\n"
+    return statement
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate a synthetic task for benchmarking.")
+    parser.add_argument("contest_dir")
+    parser.add_argument("--name", default="synth")
+    parser.add_argument("--tests", type=int, default=50)
+    parser.add_argument("--test-size", type=int, default=10000, help="bytes per input file")
+    parser.add_argument("--groups", type=int, default=5, help="number of scored groups")
+    parser.add_argument("--examples", type=int, default=2)
+    parser.add_argument("--figures", type=int, default=2)
+    parser.add_argument("--figure-size", type=int, default=64, help="side of the figures in pixels")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    print(generate_task(args.contest_dir, args.name, args.tests, args.test_size, args.groups, args.examples,
+                        args.figures, args.figure_size, args.seed))
@@ -1,151 +1,81 @@
 #! /usr/bin/python
 
-import json
-import os.path
+import argparse
 import sys
-import traceback
-from pathlib import Path
 
-import yaml
-from polygon_api import *
+from lib.cli import ExportAborted
+from lib.export_contest import export_contest
+from lib.export_task import create_polygon_client, export_task
+from lib.polygon_client import DEFAULT_API_URL
+from lib.streaming_upload import DEFAULT_UPLOAD_BUFFER_SIZE
+from lib.profiling import start_trace, write_trace
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Export the CMS task in the working directory to Polygon.")
+    parser.add_argument("--upload-workers", type=int, default=4,
+                        help="number of tests uploaded to Polygon concurrently (default: 4)")
+    parser.add_argument("--upload-buffer", type=int, default=DEFAULT_UPLOAD_BUFFER_SIZE, metavar="BYTES",
+                        help="size of the blocks in which tests and other files are read and uploaded "
+                             "(default: %s)" % DEFAULT_UPLOAD_BUFFER_SIZE)
+    parser.add_argument("--validate-workers", type=int, default=1,
+                        help="number of tests the solution is validated on in parallel (default: 1)")
+    parser.add_argument("--keep-going", action="store_true",
+                        help="don't stop validating at the first failing test, report every test's verdict")
+    parser.add_argument("--memory-cap", action="store_true",
+                        help="limit the solution's address space to the memory limit while validating")
+    parser.add_argument("--calibrate", action="store_true",
+                        help="time the model solution on the largest tests and offer a time limit based on it")
+    parser.add_argument("--interpreters", action="store_true",
+                        help="time a Python model solution under every installed Python interpreter")
+    parser.add_argument("--testlib", metavar="PATH",
+                        help="testlib.h to precompile once and reuse when compiling checkers that include it")
+    parser.add_argument("--generators", action="store_true",
+                        help="upload the generators in gen/ and a test script made from gen/GEN instead of the "
+                             "generated tests")
+    parser.add_argument("--full", action="store_true",
+                        help="upload everything again, even if it is unchanged since the last run")
+    parser.add_argument("--resume", action="store_true",
+                        help="continue an interrupted export from polygon/checkpoint.json")
+    parser.add_argument("--answers", metavar="FILE",
+                        help="answers to the questions asked during the export (see README)")
+    parser.add_argument("--unattended", action="store_true",
+                        help="abort instead of asking when an answer is missing from the answers files")
+    parser.add_argument("--api-url", default=DEFAULT_API_URL,
+                        help="Polygon API URL, e.g. of a local fake server for testing (default: %(default)s)")
+    parser.add_argument("--max-retries", type=int, default=5,
+                        help="how many times a failed idempotent Polygon API call is retried (default: 5)")
+    parser.add_argument("--rate-limit", type=float, default=0.0,
+                        help="maximum Polygon API calls per second, 0 for unlimited (default: 0)")
+    parser.add_argument("--trace", metavar="FILE",
+                        help="write a JSON report with the timings of phases, API calls and subprocesses to FILE")
+    parser.add_argument("--profile-dir", metavar="DIR",
+                        help="write a cProfile dump of every phase to DIR")
+    parser.add_argument("--contest", metavar="DIR",
+                        help="export every task in the contest directory DIR instead of the working directory")
+    parser.add_argument("--jobs", type=int, default=1,
+                        help="with --contest, number of tasks exported in parallel (default: 1)")
+    return parser.parse_args()
 
-from lib.cli import *
-from lib.export_basic_info import export_basic_info
-from lib.export_checker import export_checker
-from lib.export_context import ExportContext, ScoringMode
-from lib.export_solution import export_solution
-from lib.export_statements import export_statements
-from lib.export_tests import export_tests
-from lib.output_only import generate_secret_token
-from lib.output_only_strategy import OutputOnlyStrategyType, OutputOnlyStrategy
-from lib.parse_statement import *
 
 if __name__ == "__main__":
-    ctx = ExportContext()
-    if os.path.exists("task.yaml"):
-        with open("task.yaml") as yaml_stream:
-            ctx.task_config = yaml.safe_load(yaml_stream)
-    else:
-        early_short_name = Path(os.getcwd()).name
-        yaml_path = "../" + early_short_name + ".yaml"
-        with open(yaml_path) as yaml_stream:
-            ctx.task_config = yaml.safe_load(yaml_stream)
-
-    ctx.is_output_only = "output_only" in ctx.task_config and ctx.task_config["output_only"]
-    if ctx.task_config["score_type"] == "GroupSum" or ctx.task_config["score_type"] == "Sum" \
-            or ctx.task_config["score_type"] == "GroupSumConditional" \
-            or ctx.task_config["score_type"] == "GroupSumAtLeastTwo":
-        ctx.scoring_mode = ScoringMode.GROUP_SUM
-    elif ctx.task_config["score_type"] == "GroupMin" or ctx.task_config["score_type"] == "GroupMul":
-        ctx.scoring_mode = ScoringMode.GROUP_MIN
-    else:
-        raise Exception("unknown score_type in task.yaml")
-
-    ctx.is_interactive = os.path.exists("check/batchmanager.cpp") or os.path.exists(
-        "check/interactor.cpp") or os.path.exists("interactor")
-    print("output only: %s, interactive: %s, scoring_mode: %s" %
-          (ctx.is_output_only, ctx.is_interactive, ctx.scoring_mode))
-    if not confirm("Is this correct?"):
-        print("Please fix it.")
-        sys.exit()
-
-    contest_name = Path(os.getcwd()).parent.name
-    polygon_name = ("eio-" + contest_name + "-" + ctx.task_config["name"]).lower()
-
-    with open(os.environ["HOME"] + "/.cms2pg/auth.json") as auth_stream:
-        auth = json.load(auth_stream)
-
-    polygon = Polygon("https://polygon.codeforces.com/api/", auth["key"], auth["secret"])
+    args = parse_args()
+    if args.trace is not None or args.profile_dir is not None:
+        start_trace(args.profile_dir)
 
     try:
-        print("Creating problem with name %s on polygon..." % polygon_name)
-        problem = polygon.problem_create(polygon_name)
-        ctx.polygon_id = problem.id
-        print("Done.")
-    except PolygonRequestFailedException as ex:
-        if str(ex) == "name: You already have such problem":
-            ret = confirm("""A problem with name %s already exists. 
-This script will now overwrite it. Is that ok?""" % polygon_name)
-            if not ret:
-                sys.exit()
-
-            existing = polygon.problems_list(name=polygon_name)
-            if len(existing) != 1:
-                raise Exception("found multiple or no problems with that name")
-
-            ctx.polygon_id = existing[0].id
-        else:
-            print(traceback.format_exc())
+        if args.contest is not None:
+            export_contest(args.contest, args)
             sys.exit()
 
-    print("Problem id is %s." % ctx.polygon_id)
-
-    if ctx.is_output_only:
-        print("""This problem is output-only.
-Supporting an output-only problem on Polygon/Codeforces requires some trickery. We have the following 
-strategies for doing that:
-0: MANUAL. This script won't upload any solution or input/output pairs to Polygon.
-1: CONCAT. The "input" files on Polygon (not to be confused with the real input files which are instead
-attachments to the problem) are actually concatenated input + output, with a special separator.
-The fake solution we will upload to Polygon ignores input until the separator, and echoes the rest.
-Considerations:
-- If your checker requires a 'hint' file, you need to use this strategy.
-- Your checker needs to be able to ignore the extra content in the input.
-- People using the archive will partially see the optimal outputs.
-2. TOKEN: The input files on Polygon are authentic. The fake solution we upload to Polygon will output
-an answer of the form '-1 -1 -1 -1 -1 (irrelevant tokens) (secret token)'. Your checker will need to
-accept outputs like this as correct.
-Considerations:
-- Your checker must not require any 'hint' or 'answer' file.
-- Your checker needs to be able to detect answers like this without compromising its correctness on
-other solutions.""")
-
-        while True:
-            resp = input("Make your choice [0/1/2]: ")
-            if resp == "0":
-                ctx.output_only_strategy = OutputOnlyStrategy(OutputOnlyStrategyType.MANUAL)
-                break
-            elif resp == "1":
-                ctx.output_only_strategy = OutputOnlyStrategy(OutputOnlyStrategyType.CONCAT)
-                while True:
-                    separator = input("Choose a separator (single character only): ")
-                    if len(separator) == 1:
-                        ctx.output_only_strategy.separator = separator
-                        break
-                    else:
-                        print("Separator is not single-character, try again.")
-                break
-            elif resp == "2":
-                token = generate_secret_token()
-                ctx.output_only_strategy = OutputOnlyStrategy(OutputOnlyStrategyType.TOKEN)
-                ctx.output_only_strategy.secret_token = token
-                print("Your secret token is %s" % token)
-                break
-            else:
-                print("Invalid response, try again...")
-
-    export_basic_info(polygon, ctx)
-    export_tests(polygon, ctx)
-    export_checker(polygon, ctx)
-    export_solution(polygon, ctx)
-    export_statements(polygon, ctx)
-
-    if ctx.is_interactive:
-        print("""This problem is interactive. You will likely need to make significant changes to the interactor and/or 
-checker. Commit the changes and package the problem when done.""")
-    elif ctx.is_output_only:
-        print("""This problem is output-only. You will need to upload the the input package and might need to make other
-changes too. Commit the changes and package the problem when done.""")
-    else:
-        print("Committing changes...")
-        polygon.problem_commit_changes(ctx.polygon_id, minor_changes=True, message="import with cms2pg")
-
-        print("Initiating package build...")
-        # lib doesn't have that method
-        polygon._request_ok_or_raise("problem.buildPackage",
-                                     args={
-                                         "problemId": ctx.polygon_id,
-                                         "full": False,
-                                         "verify": True
-                                     })
-        print("Give READ access to 'codeforces' user. The problem is ready.")
+        polygon = create_polygon_client(args)
+        try:
+            export_task(polygon, args)
+        except ExportAborted as ex:
+            print(ex)
+            sys.exit()
+        finally:
+            polygon.print_stats()
+    finally:
+        if args.trace is not None:
+            write_trace(args.trace)
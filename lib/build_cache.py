@@ -0,0 +1,68 @@
+import os
+import re
+import shutil
+from pathlib import Path
+from typing import List
+
+from lib import profiling
+from lib.manifest import content_hash
+
+BUILD_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cms2pg", "build-cache")
+
+_LOCAL_INCLUDE = re.compile(rb'^\s*#\s*include\s*"([^"]+)"', re.MULTILINE)
+
+
+# the key covers the source, headers it includes with #include "..." from its own
+# directory, the compiler binary (path and mtime, to notice upgrades) and the flags
+def build_key(compiler: str, flags: List[str], source_path: str) -> str:
+    with open(source_path, "rb") as source_stream:
+        source = source_stream.read()
+
+    parts = [source]
+    source_dir = os.path.dirname(source_path)
+    for include in sorted(set(_LOCAL_INCLUDE.findall(source))):
+        header_path = os.path.join(source_dir, include.decode(errors="replace"))
+        if os.path.isfile(header_path):
+            with open(header_path, "rb") as header_stream:
+                parts += [include, header_stream.read()]
+
+    compiler_path = shutil.which(compiler) or compiler
+    compiler_mtime = os.path.getmtime(compiler_path) if os.path.exists(compiler_path) else None
+    parts += [compiler_path, compiler_mtime] + flags
+    return content_hash(*parts)
+
+
+# compiles source_path to target_path, or copies the binary from an earlier build of the
+# same source with the same compiler and flags. flags go after the source (e.g. -lm)
+def compile_cached(compiler: str, flags: List[str], source_path: str, target_path: str,
+                   cache_dir: str = BUILD_CACHE_DIR):
+    cached_path = os.path.join(cache_dir, build_key(compiler, flags, source_path))
+    if os.path.exists(cached_path):
+        print("Using cached build of %s." % source_path)
+    else:
+        Path(cache_dir).mkdir(parents=True, exist_ok=True)
+        tmp_path = "%s.%s.tmp" % (cached_path, os.getpid())
+        profiling.run([compiler, source_path, "-o", tmp_path] + flags, check=True)
+        os.replace(tmp_path, cached_path)
+
+    tmp_target = target_path + ".tmp"
+    shutil.copy2(cached_path, tmp_target)
+    os.replace(tmp_target, target_path)
+
+
+# builds a precompiled header from testlib_path (once per testlib version and flags)
+# and returns flags that make a compilation use it. testlib.h has include guards, so
+# the source's own #include "testlib.h" is then a no-op, but it still has to resolve
+def testlib_pch_flags(testlib_path: str, compiler: str, flags: List[str],
+                      cache_dir: str = BUILD_CACHE_DIR) -> List[str]:
+    pch_dir = os.path.join(cache_dir, "pch-" + build_key(compiler, flags, testlib_path))
+    header_path = os.path.join(pch_dir, "testlib.h")
+    if not os.path.exists(header_path + ".gch"):
+        print("Precompiling %s..." % testlib_path)
+        Path(pch_dir).mkdir(parents=True, exist_ok=True)
+        shutil.copyfile(testlib_path, header_path)
+        profiling.run([compiler, "-x", "c++-header", header_path, "-o", header_path + ".gch.tmp"] + flags,
+                      check=True)
+        os.replace(header_path + ".gch.tmp", header_path + ".gch")
+
+    return ["-I", pch_dir, "-include", header_path]
@@ -0,0 +1,183 @@
+import math
+import os
+import shutil
+import statistics
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from polygon_api import Polygon
+
+from lib.cli import confirm
+from lib.export_basic_info import effective_time_limit, export_basic_info, polygon_time_limit
+from lib.export_context import ExportContext
+from lib.genfile import TestGroup
+from lib.validate_solution import Language, TestRun, build_solution, compiling_python_versions, measure_test, \
+    report_test_run, run_test, solution_language
+
+CALIBRATION_DIR = "polygon/working/calibration"
+# manifest key of the time limit calibration set, as "[task.yaml's limit]:[calibrated limit]"
+CALIBRATED_TIME_LIMIT_KEY = "calibrated_time_limit"
+# how many of the largest tests are measured, and how many times each
+CALIBRATION_TESTS = 5
+CALIBRATION_RUNS = 5
+# runs per test for each Python interpreter
+INTERPRETER_RUNS = 3
+# the recommended limit is the slowest measured run times this. Codeforces asks for at least
+# twice the model solution's time on its own machines, which may be slower than this one
+SAFETY_MARGIN = 3.0
+
+# close to how Codeforces compiles C and C++ (it also links statically on Windows)
+CODEFORCES_COMPILERS = {
+    Language.CPP: ("g++", ["-O2", "-std=c++17", "-DONLINE_JUDGE"]),
+    Language.C: ("gcc", ["-O2", "-std=c11", "-DONLINE_JUDGE", "-lm"]),
+}
+
+# Polygon's languages for Python solutions and the interpreters that run them, by Python version
+PYTHON_INTERPRETERS = {
+    Language.PY3: [("python.3", "python3"), ("python.pypy3", "pypy3")],
+    Language.PY2: [("python.2", "python2"), ("python.pypy2", "pypy")],
+}
+
+
+# the time limit for a solution whose slowest run took cpu_time seconds, in milliseconds,
+# rounded up to what Polygon accepts
+def recommended_time_limit(cpu_time: float) -> int:
+    time_limit = 50 * math.ceil(cpu_time * SAFETY_MARGIN * 1000 / 50)
+    return min(max(time_limit, 250), 15000)
+
+
+# restores the time limit an earlier export's calibration set on Polygon, so that it isn't
+# reset to task.yaml's. it's dropped once task.yaml's limit changes
+def load_calibrated_time_limit(ctx: ExportContext):
+    entry = ctx.manifest.entries.get(CALIBRATED_TIME_LIMIT_KEY)
+    if entry is None:
+        return
+
+    task_time_limit, calibrated = entry.split(":")
+    if int(task_time_limit) == polygon_time_limit(ctx.task_config):
+        ctx.time_limit_override = int(calibrated)
+    else:
+        print("The time limit in task.yaml changed, dropping the calibrated time limit of %s ms." % calibrated)
+        ctx.time_limit_override = None
+        ctx.manifest.forget(CALIBRATED_TIME_LIMIT_KEY)
+
+
+def save_calibrated_time_limit(ctx: ExportContext, time_limit: int):
+    task_time_limit = polygon_time_limit(ctx.task_config)
+    if time_limit == task_time_limit:
+        ctx.time_limit_override = None
+        ctx.manifest.forget(CALIBRATED_TIME_LIMIT_KEY)
+    else:
+        ctx.time_limit_override = time_limit
+        ctx.manifest.record(CALIBRATED_TIME_LIMIT_KEY, "%s:%s" % (task_time_limit, time_limit))
+
+
+# the largest tests with their groups, largest first
+def heaviest_tests(ctx: ExportContext) -> List[Tuple[TestGroup, str]]:
+    tests = [(group, test) for group in ctx.gen_file for test in group.files]
+    tests.sort(key=lambda t: os.path.getsize(os.path.join("input", t[1])), reverse=True)
+    return tests[:CALIBRATION_TESTS]
+
+
+# CPU times of running args on each test runs times, by test. None if a run fails. only the
+# first run on a test is checked, the others are just measured
+def time_solution(args: List[str], tests: List[Tuple[TestGroup, str]], runs: int,
+                  ctx: ExportContext) -> Optional[Dict[str, List[float]]]:
+    times_by_test = {}
+    for group, test in tests:
+        times_by_test[test] = []
+        for i in range(runs):
+            test_run = TestRun(group, test)
+            if i == 0:
+                run_test(test_run, args, CALIBRATION_DIR, ctx)
+                failed = test_run.is_failure
+            else:
+                failed = measure_test(test_run, args, CALIBRATION_DIR, ctx) is None
+            if failed:
+                print("The solution fails on test %s." % test)
+                report_test_run(test_run)
+                return None
+            times_by_test[test].append(test_run.measurement.cpu_time)
+    return times_by_test
+
+
+# runs the model solution several times on the largest tests and recommends a time limit
+# from the slowest run. tests are run one at a time, so that they don't slow each other down
+def calibrate_time_limit(polygon: Polygon, ctx: ExportContext, model_solution_path: str):
+    if ctx.is_interactive:
+        print("Interactive solutions can't be run locally, skipping time limit calibration.")
+        return
+
+    language = solution_language(model_solution_path, ctx)
+    if language is None:
+        return
+
+    Path(CALIBRATION_DIR).mkdir(parents=True, exist_ok=True)
+    args = build_solution(model_solution_path, language, CALIBRATION_DIR, CODEFORCES_COMPILERS)
+
+    tests = heaviest_tests(ctx)
+    print("Calibrating the time limit on %s tests, %s runs each..." % (len(tests), CALIBRATION_RUNS))
+    times_by_test = time_solution(args, tests, CALIBRATION_RUNS, ctx)
+    if times_by_test is None:
+        print("Not recommending a time limit.")
+        return
+
+    slowest = 0.0
+    for test, times in times_by_test.items():
+        median = statistics.median(times)
+        spread = (max(times) - min(times)) / median if median > 0 else 0.0
+        print("%s: median %s ms, min %s ms, max %s ms, spread %.0f%%" %
+              (test, int(median * 1000), int(min(times) * 1000), int(max(times) * 1000), spread * 100))
+        if spread > 0.2:
+            print("Warning: the times on %s vary a lot, the machine may be busy." % test)
+        slowest = max(slowest, max(times))
+
+    current = effective_time_limit(ctx)
+    recommended = recommended_time_limit(slowest)
+    print("The slowest run took %s ms. With a safety margin of %sx, the recommended time limit is %s ms "
+          "(on Polygon: %s ms, from task.yaml: %s ms)." %
+          (int(slowest * 1000), SAFETY_MARGIN, recommended, current, polygon_time_limit(ctx.task_config)))
+    if recommended == current:
+        return
+
+    if confirm("Do you want to set the time limit on Polygon to %s ms?" % recommended, "apply_calibrated_time_limit"):
+        save_calibrated_time_limit(ctx, recommended)
+        export_basic_info(polygon, ctx)
+
+
+# times a Python model solution under every installed interpreter of each Python version it
+# compiles under, and reports which Polygon language leaves the most time to spare
+def benchmark_interpreters(ctx: ExportContext, model_solution_path: str):
+    if ctx.is_interactive or not model_solution_path.endswith(".py"):
+        return
+
+    versions = compiling_python_versions(model_solution_path)
+    if len(versions) == 0:
+        versions = [solution_language(model_solution_path, ctx)]
+    candidates = [(tag, interpreter) for version in versions for tag, interpreter in PYTHON_INTERPRETERS[version]
+                  if shutil.which(interpreter) is not None]
+
+    Path(CALIBRATION_DIR).mkdir(parents=True, exist_ok=True)
+    args = build_solution(model_solution_path, versions[0], CALIBRATION_DIR)
+    tests = heaviest_tests(ctx)
+    time_limit = effective_time_limit(ctx)
+
+    slowest_by_tag = {}
+    for tag, interpreter in candidates:
+        print("Timing the solution with %s on %s tests, %s runs each..." % (interpreter, len(tests), INTERPRETER_RUNS))
+        times_by_test = time_solution([interpreter] + args[1:], tests, INTERPRETER_RUNS, ctx)
+        if times_by_test is not None:
+            slowest_by_tag[tag] = max(max(times) for times in times_by_test.values())
+
+    print("Python interpreters (Polygon time limit %s ms):" % time_limit)
+    for tag, interpreter in candidates:
+        if tag in slowest_by_tag:
+            slowest = int(slowest_by_tag[tag] * 1000)
+            print("%s (%s): slowest run %s ms, %s%% of the time limit" %
+                  (tag, interpreter, slowest, slowest * 100 // time_limit))
+        else:
+            print("%s (%s): fails" % (tag, interpreter))
+
+    if len(slowest_by_tag) > 0:
+        best = min(slowest_by_tag, key=slowest_by_tag.get)
+        print("%s gives the most headroom. Choose it as the solution's language on Polygon if it isn't already." % best)
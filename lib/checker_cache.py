@@ -0,0 +1,69 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, Tuple
+
+from lib import profiling
+from lib.manifest import content_hash, stream_hash
+
+CHECKER_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cms2pg", "checker-cache")
+
+
+def _file_digest(path: str) -> str:
+    with open(path, "rb") as stream:
+        return stream_hash(stream)
+
+
+# a testlib checker accepts with exit code 0, or with 7 (partial points) and all of the points
+def _accepts(returncode: int, stderr: str) -> bool:
+    return returncode == 0 or (returncode == 7 and stderr.startswith("points 100"))
+
+
+# whether the checker accepts output_path as the output for input_path with answer answer_path,
+# and whether it accepts them the other way around (answer_path as the output). verdicts are
+# cached by the contents of the checker binary and the three files, and the runs that aren't
+# cached happen concurrently
+def check_both_ways(checker_path: str, input_path: str, output_path: str, answer_path: str,
+                    cache_dir: str = CHECKER_CACHE_DIR) -> Tuple[bool, bool]:
+    if not os.path.exists(output_path):
+        return False, False
+
+    checker_digest = _file_digest(checker_path)
+    input_digest = _file_digest(input_path)
+    output_digest = _file_digest(output_path)
+    answer_digest = _file_digest(answer_path)
+    runs = [
+        (content_hash(checker_digest, input_digest, output_digest, answer_digest),
+         [checker_path, input_path, output_path, answer_path]),
+        (content_hash(checker_digest, input_digest, answer_digest, output_digest),
+         [checker_path, input_path, answer_path, output_path]),
+    ]
+
+    verdicts: Dict[str, bool] = {}
+    missing = []
+    for key, args in runs:
+        cached_path = os.path.join(cache_dir, key)
+        if os.path.exists(cached_path):
+            with open(cached_path) as cached_stream:
+                verdicts[key] = cached_stream.read() == "OK"
+        else:
+            missing.append((key, args))
+
+    def run(args):
+        return profiling.run(args, text=True, capture_output=True)
+
+    if len(missing) > 0:
+        Path(cache_dir).mkdir(parents=True, exist_ok=True)
+        with ThreadPoolExecutor(max_workers=len(missing)) as executor:
+            results = list(executor.map(run, [args for _, args in missing]))
+
+        for (key, _), result in zip(missing, results):
+            verdicts[key] = _accepts(result.returncode, result.stderr)
+            cached_path = os.path.join(cache_dir, key)
+            tmp_path = "%s.%s.%s.tmp" % (cached_path, os.getpid(), threading.get_ident())
+            with open(tmp_path, "w") as cached_stream:
+                cached_stream.write("OK" if verdicts[key] else "WA")
+            os.replace(tmp_path, cached_path)
+
+    return verdicts[runs[0][0]], verdicts[runs[1][0]]
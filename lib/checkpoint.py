@@ -0,0 +1,84 @@
+import json
+import os
+import threading
+from dataclasses import asdict
+from pathlib import Path
+
+from lib.export_context import ExportContext, ScoringMode
+from lib.genfile import TestGroup
+from lib.output_only_strategy import OutputOnlyStrategy, OutputOnlyStrategyType
+
+CHECKPOINT_PATH = "polygon/checkpoint.json"
+
+# tests are checkpointed from the upload threads
+_lock = threading.RLock()
+
+
+# writes the state of an export in progress, so that an interrupted export can be resumed.
+# the task config and command line options are not included, they're read again on resume
+def save_checkpoint(ctx: ExportContext, path: str = CHECKPOINT_PATH):
+    with _lock:
+        data = {
+            "polygon_id": ctx.polygon_id,
+            "is_interactive": ctx.is_interactive,
+            "is_output_only": ctx.is_output_only,
+            "scoring_mode": ctx.scoring_mode.name,
+            "output_only_strategy": None,
+            "gen_file": None if ctx.gen_file is None else [asdict(group) for group in ctx.gen_file],
+            "has_custom_checker": ctx.has_custom_checker,
+            "custom_checker_path": ctx.custom_checker_path,
+            "time_limit_override": ctx.time_limit_override,
+            "test_group_by_polygon_id": ctx.test_group_by_polygon_id,
+            "test_points_by_polygon_id": ctx.test_points_by_polygon_id,
+            "completed_phases": ctx.completed_phases,
+            "uploaded_tests": sorted(ctx.uploaded_tests),
+        }
+        if ctx.output_only_strategy is not None:
+            data["output_only_strategy"] = {
+                "strategy_type": ctx.output_only_strategy.strategy_type.name,
+                "separator": ctx.output_only_strategy.separator,
+                "secret_token": ctx.output_only_strategy.secret_token,
+            }
+
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w") as checkpoint_stream:
+            json.dump(data, checkpoint_stream, indent=2)
+        os.replace(tmp_path, path)
+
+
+# restores the state saved by save_checkpoint into ctx
+def load_checkpoint(ctx: ExportContext, path: str = CHECKPOINT_PATH):
+    with open(path) as checkpoint_stream:
+        data = json.load(checkpoint_stream)
+
+    ctx.polygon_id = data["polygon_id"]
+    ctx.is_interactive = data["is_interactive"]
+    ctx.is_output_only = data["is_output_only"]
+    ctx.scoring_mode = ScoringMode[data["scoring_mode"]]
+    if data["output_only_strategy"] is not None:
+        strategy = data["output_only_strategy"]
+        ctx.output_only_strategy = OutputOnlyStrategy(OutputOnlyStrategyType[strategy["strategy_type"]],
+                                                      strategy["separator"],
+                                                      strategy["secret_token"])
+    if data["gen_file"] is not None:
+        ctx.gen_file = [TestGroup(**group) for group in data["gen_file"]]
+    ctx.has_custom_checker = data["has_custom_checker"]
+    ctx.custom_checker_path = data["custom_checker_path"]
+    ctx.time_limit_override = data.get("time_limit_override")
+    # json object keys are always strings
+    ctx.test_group_by_polygon_id = {int(k): v for k, v in data["test_group_by_polygon_id"].items()}
+    ctx.test_points_by_polygon_id = {int(k): v for k, v in data["test_points_by_polygon_id"].items()}
+    ctx.completed_phases = data["completed_phases"]
+    ctx.uploaded_tests = set(data["uploaded_tests"])
+
+
+def save_uploaded_test(ctx: ExportContext, test_index: int, path: str = CHECKPOINT_PATH):
+    with _lock:
+        ctx.uploaded_tests.add(test_index)
+        save_checkpoint(ctx, path)
+
+
+def remove_checkpoint(path: str = CHECKPOINT_PATH):
+    if os.path.exists(path):
+        os.remove(path)
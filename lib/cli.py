@@ -1,16 +1,93 @@
-def confirm(message: str):
+import os
+from typing import Callable
+
+import yaml
+
+# answers given up front in an answers file, by question key (see load_answers)
+_answers = {}
+# if set, a question without an answer aborts the export instead of waiting for input
+_unattended = False
+
+
+# raised when the user (or a problem with the task) stops the export
+class ExportAborted(Exception):
+    pass
+
+
+class MissingAnswer(ExportAborted):
+    def __init__(self, key: str):
+        super().__init__("no answer for '%s' in the answers file" % key)
+        self.key = key
+
+
+# an answers file has question keys at the top level. a contest-wide file can also have
+# a "tasks" section with answers for single tasks by task name, which take precedence
+def load_answers(paths, task_name: str) -> dict:
+    answers = {}
+    for path in paths:
+        if path is None or not os.path.exists(path):
+            continue
+
+        with open(path) as answers_stream:
+            data = yaml.safe_load(answers_stream) or {}
+
+        task_answers = data.pop("tasks", None) or {}
+        answers.update(data)
+        answers.update(task_answers.get(task_name, None) or {})
+
+    return answers
+
+
+def set_answers(answers: dict, unattended: bool):
+    global _answers, _unattended
+    _answers = answers
+    _unattended = unattended
+
+
+def has_answer(key: str) -> bool:
+    return key in _answers
+
+
+# returns the answer to the question key from the answers file, or asks with ask()
+def answer(key: str, ask: Callable):
+    if key in _answers:
+        print("Using answer '%s' for %s from the answers file." % (_answers[key], key))
+        return _answers[key]
+    if _unattended:
+        raise MissingAnswer(key)
+    return ask()
+
+
+def confirm(message: str, key: str = None):
     print(message)
-    while True:
-        resp = input("Please answer Y or N: ")
-        if resp == "Y":
-            return True
-        elif resp == "N":
-            return False
 
+    def ask():
+        while True:
+            resp = input("Please answer Y or N: ")
+            if resp == "Y":
+                return True
+            elif resp == "N":
+                return False
+
+    if key is None:
+        return ask()
+
+    resp = answer(key, ask)
+    if not isinstance(resp, bool):
+        raise ExportAborted("answer for '%s' must be yes or no, got '%s'" % (key, resp))
+    return resp
 
-def manual(message: str):
+
+def manual(message: str, key: str = None):
     print(message)
-    while True:
-        resp = input("Write 'done' without quotes when done: ")
-        if resp == "done":
-            return
+
+    def ask():
+        while True:
+            resp = input("Write 'done' without quotes when done: ")
+            if resp == "done":
+                return True
+
+    if key is None:
+        ask()
+    elif not answer(key, ask):
+        raise ExportAborted("manual step '%s' is not done" % key)
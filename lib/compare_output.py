@@ -0,0 +1,186 @@
+import os
+from dataclasses import dataclass
+
+# whitespace ignored at the end of a line, like C isspace() minus the newline itself
+_TRAILING_SPACE = b" \t\r\v\f"
+_SPACE_BEFORE_NEWLINE = [bytes([space]) + b"\n" for space in _TRAILING_SPACE]
+
+# files are compared in pieces of about this size
+CHUNK_SIZE = 1 << 20
+
+# how much of the differing lines is shown around the first difference
+_CONTEXT_BYTES = 30
+
+
+@dataclass
+class OutputDifference:
+    line: int  # 1-based
+    column: int  # 1-based, in bytes
+    actual: str  # excerpt of the actual line around the difference, None if there is no such line
+    expected: str
+
+    def __str__(self):
+        if self.actual is None:
+            return "Output ends at line %s, but the expected output continues with '%s'." \
+                   % (self.line, self.expected)
+        if self.expected is None:
+            return "Expected output ends at line %s, but the output continues with '%s'." \
+                   % (self.line, self.actual)
+        return "Output differs at line %s, column %s: expected '%s', got '%s'." \
+               % (self.line, self.column, self.expected, self.actual)
+
+
+# same semantics as diff --ignore-trailing-space --strip-trailing-cr: files are compared line
+# by line, whitespace at the end of each line is ignored, a missing newline at the end of the
+# file isn't a difference, but extra (even empty) lines are.
+# returns None if the files match, otherwise the first difference
+def compare_outputs(actual_path: str, expected_path: str) -> OutputDifference:
+    if _files_identical(actual_path, expected_path):
+        return None
+
+    # both files are normalized block by block and compared as bytes; only the first block
+    # that differs is searched for the line and column of the difference
+    actual = _NormalizedFile(actual_path)
+    expected = _NormalizedFile(expected_path)
+    line = 1
+    column = 1  # of the start of the buffered data
+    line_head = b""  # the end of the current line before the buffered data
+    while True:
+        actual.fill()
+        expected.fill()
+        # an empty file has no lines, unlike one with just a newline or whitespace
+        if len(actual.data) == 0 and len(expected.data) == 0 and actual.empty == expected.empty:
+            return None
+
+        common = min(len(actual.data), len(expected.data))
+        if common > 0 and actual.data[:common] == expected.data[:common]:
+            compared = actual.data[:common]
+            newlines = compared.count(b"\n")
+            if newlines == 0:
+                column += common
+                line_head = (line_head + compared)[-_CONTEXT_BYTES:]
+            else:
+                line += newlines
+                line_start = compared.rfind(b"\n") + 1
+                column = common - line_start + 1
+                line_head = compared[line_start:][-_CONTEXT_BYTES:]
+            actual.data = actual.data[common:]
+            expected.data = expected.data[common:]
+            continue
+
+        offset = _first_mismatch(actual.data, expected.data, common)
+        # enough of both lines to show them after the difference
+        actual.fill(offset + _CONTEXT_BYTES + 2)
+        expected.fill(offset + _CONTEXT_BYTES + 2)
+        line_start = actual.data.rfind(b"\n", 0, offset) + 1
+        if line_start > 0:
+            line += actual.data.count(b"\n", 0, offset)
+            column = 1
+            line_head = b""
+        column += offset - line_start
+
+        # one of the files ends here: if the other continues with more lines, report those
+        for ended, other in [(actual, expected), (expected, actual)]:
+            if offset == len(ended.data) and (ended.empty or other.data[offset:offset + 1] == b"\n"):
+                if not ended.empty:
+                    line += 1
+                    offset += 1
+                rest = _excerpt(b"", 0, other.data, offset)
+                if ended is actual:
+                    return OutputDifference(line, 1, None, rest)
+                return OutputDifference(line, 1, rest, None)
+
+        return OutputDifference(line, column,
+                                _excerpt(line_head + actual.data[line_start:offset], column - 1, actual.data, offset),
+                                _excerpt(line_head + expected.data[line_start:offset], column - 1, expected.data,
+                                         offset))
+
+
+def _files_identical(first_path: str, second_path: str) -> bool:
+    with open(first_path, "rb") as first, open(second_path, "rb") as second:
+        while True:
+            first_chunk = first.read(CHUNK_SIZE)
+            if first_chunk != second.read(CHUNK_SIZE):
+                return False
+            if len(first_chunk) == 0:
+                return True
+
+
+# a file with the whitespace at the end of every line and the final newline removed, read in
+# blocks of about CHUNK_SIZE. blocks end just before a newline (which may turn out to be the
+# final one), or inside a line that is longer than a block, after a byte that isn't whitespace
+class _NormalizedFile:
+    def __init__(self, path: str):
+        self.empty = os.path.getsize(path) == 0
+        self.data = b""  # normalized data not compared yet
+        self._blocks = self._read_blocks(path)
+        self._done = False
+
+    def _read_blocks(self, path: str):
+        with open(path, "rb") as stream:
+            pending = b""
+            while True:
+                chunk = stream.read(CHUNK_SIZE)
+                if len(chunk) == 0:
+                    break
+
+                data = pending + chunk
+                cut = data.rfind(b"\n")
+                if cut <= 0:
+                    cut = len(data.rstrip(_TRAILING_SPACE))
+                    if cut == 1 and data[0] == ord("\n"):
+                        cut = 0
+                pending = data[cut:]
+                yield _strip_trailing_space(data[:cut])
+
+            last = _strip_trailing_space(pending)
+            yield last[:-1] if pending.endswith(b"\n") else last
+
+    # reads blocks until there are at least size bytes to compare or the file ends
+    def fill(self, size: int = 1):
+        while len(self.data) < size and not self._done:
+            block = next(self._blocks, None)
+            if block is None:
+                self._done = True
+            else:
+                self.data += block
+
+
+# removes the whitespace at the end of every line of block. most blocks have none, which a
+# few substring searches tell faster than splitting the block into lines
+def _strip_trailing_space(block: bytes) -> bytes:
+    ends_with_space = len(block) > 0 and block[-1] in _TRAILING_SPACE
+    if not ends_with_space and not any(pattern in block for pattern in _SPACE_BEFORE_NEWLINE):
+        return block
+    return b"\n".join(line.rstrip(_TRAILING_SPACE) for line in block.split(b"\n"))
+
+
+# index of the first byte in which first and second differ among their first length bytes,
+# length if there's none. halves the range with comparisons of slices rather than stepping
+# through single bytes
+def _first_mismatch(first: bytes, second: bytes, length: int) -> int:
+    low, high = 0, length
+    while high - low > 64:
+        middle = (low + high) // 2
+        if first[low:middle] == second[low:middle]:
+            low = middle
+        else:
+            high = middle
+    for i in range(low, high):
+        if first[i] != second[i]:
+            return i
+    return high
+
+
+# the line around a difference: head is the line up to the difference (only its end is
+# needed), which is at column offset_in_line + 1; the line continues in data from offset
+def _excerpt(head: bytes, offset_in_line: int, data: bytes, offset: int) -> str:
+    end = data.find(b"\n", offset)
+    if end == -1:
+        end = len(data)
+    excerpt = (head[-_CONTEXT_BYTES:] + data[offset:min(end, offset + _CONTEXT_BYTES)]).decode(errors="replace")
+    if offset_in_line > _CONTEXT_BYTES:
+        excerpt = "..." + excerpt
+    if end > offset + _CONTEXT_BYTES:
+        excerpt += "..."
+    return excerpt
@@ -1,4 +1,20 @@
 import os
+import re
+import shutil
+import subprocess
+import tempfile
+from concurrent.futures import Executor
+from pathlib import Path
+
+from lib import profiling
+from lib.manifest import file_hash
+
+CONVERSION_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cms2pg", "conversion-cache")
+
+# resolution of PDF statements rendered to images
+PDF_DENSITY = 100
+
+_PDF_PAGE = re.compile(rb"/Type\s*/Page(?![a-zA-Z])")
 
 
 def resolve_if_no_extension(original_name):
@@ -38,5 +54,112 @@ def should_convert(original_name):
     return False
 
 
-def convert(source, target):
-    os.system("convert %s %s" % (source, target))
+# the key covers the content of the source and the ImageMagick options, so renamed or
+# reverted figures are found in the cache too
+def conversion_key(source, options=()):
+    return file_hash(source, "convert", *options)
+
+
+# converts source to target with ImageMagick, or copies the result of an earlier conversion
+# of the same content with the same options. options go between the source and the target.
+# returns the cache key, or None if ImageMagick fails (it prints why). safe to call from
+# several processes at once
+def convert_cached(source, target, options=(), cache_dir=CONVERSION_CACHE_DIR):
+    key = conversion_key(source, options)
+    cached_path = os.path.join(cache_dir, key + os.path.splitext(target)[1])
+    if os.path.exists(cached_path):
+        print("Using cached conversion of %s." % source)
+    else:
+        tmp_path = _cache_tmp_path(cached_path)
+        try:
+            returncode = profiling.run(["convert", source] + list(options) + [tmp_path]).returncode
+        except OSError as ex:  # ImageMagick isn't installed
+            print(ex)
+            returncode = None
+        if returncode != 0:
+            print("Converting %s failed." % source, flush=True)
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return None
+        os.replace(tmp_path, cached_path)
+
+    _copy_from_cache(cached_path, target)
+    return key
+
+
+# ImageMagick picks the output format from the extension, so it has to stay last
+def _cache_tmp_path(cached_path):
+    Path(os.path.dirname(cached_path)).mkdir(parents=True, exist_ok=True)
+    name, extension = os.path.splitext(cached_path)
+    return "%s.%s.tmp%s" % (name, os.getpid(), extension)
+
+
+def _copy_from_cache(cached_path, target):
+    tmp_target = target + ".tmp"
+    shutil.copyfile(cached_path, tmp_target)
+    os.replace(tmp_target, target)
+
+
+# counts the page objects, unless they're hidden in compressed object streams or the file has
+# been updated incrementally (then old versions of pages are still there); then asks ImageMagick
+def pdf_page_count(path):
+    with open(path, "rb") as pdf_stream:
+        pdf = pdf_stream.read()
+    count = len(_PDF_PAGE.findall(pdf))
+    if count > 0 and pdf.count(b"%%EOF") <= 1:
+        return count
+
+    result = profiling.run(["identify", "-ping", "-format", "%n\n", path], check=True,
+                           stdout=subprocess.PIPE, universal_newlines=True)
+    return int(result.stdout.split()[0])
+
+
+def render_pdf_page(source, page, target, density=PDF_DENSITY):
+    profiling.run(["convert", "-density", str(density), "%s[%s]" % (source, page), target], check=True)
+
+
+# renders a PDF into a single image with its pages below each other, like
+# convert -density [density] source -append target, but with every page rendered in its own
+# process in executor. the result is cached like convert_cached. start() submits the pages,
+# result() waits for them, stitches them together and returns the cache key, so several PDFs
+# can be rendered at once
+class PdfRasterization:
+    def __init__(self, source, target, density=PDF_DENSITY, cache_dir=CONVERSION_CACHE_DIR):
+        self.source = source
+        self.target = target
+        self.density = density
+        self.key = conversion_key(source, ["-density", str(density), "-append"])
+        self.cached_path = os.path.join(cache_dir, self.key + ".png")
+        self.pages = []
+        self.started = False
+        self._page_dir = None
+
+    def start(self, executor: Executor):
+        self.started = True
+        if os.path.exists(self.cached_path):
+            return
+
+        self._page_dir = tempfile.TemporaryDirectory(prefix="cms2pg-pages-")
+        for page in range(pdf_page_count(self.source)):
+            page_path = os.path.join(self._page_dir.name, "page%s.png" % page)
+            self.pages.append((page_path, executor.submit(profiling.call_traced, render_pdf_page, self.source, page,
+                                                          page_path, self.density)))
+
+    def result(self):
+        if self._page_dir is None:
+            print("Using cached rendering of %s." % self.source)
+        else:
+            with self._page_dir:
+                for _, future in self.pages:
+                    profiling.traced_result(future)
+
+                tmp_path = _cache_tmp_path(self.cached_path)
+                if len(self.pages) == 1:
+                    shutil.copyfile(self.pages[0][0], tmp_path)
+                else:
+                    profiling.run(["convert"] + [page_path for page_path, _ in self.pages] + ["-append", tmp_path],
+                                  check=True)
+                os.replace(tmp_path, self.cached_path)
+
+        _copy_from_cache(self.cached_path, self.target)
+        return self.key
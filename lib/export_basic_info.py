@@ -3,6 +3,32 @@ from polygon_api import Polygon, ProblemInfo
 from lib.export_context import ExportContext
 
 
+# the time limit sent to Polygon, in milliseconds
+def polygon_time_limit(task_config: dict) -> int:
+    time_limit = task_config["time_limit"]  # in seconds
+    time_limit *= 20
+    time_limit = 50 * int(time_limit)  # in milliseconds, but must be multiple of 50
+    time_limit = max(time_limit, 250)
+    time_limit = min(time_limit, 15000)  # polygon constraints
+    return time_limit
+
+
+# the time limit export_basic_info sends to Polygon, in milliseconds: the one calibration set
+# (see lib/calibrate_time_limit.py), or task.yaml's
+def effective_time_limit(ctx: ExportContext) -> int:
+    if ctx.time_limit_override is not None:
+        return ctx.time_limit_override
+    return polygon_time_limit(ctx.task_config)
+
+
+# the memory limit sent to Polygon, in MB
+def polygon_memory_limit(task_config: dict) -> int:
+    memory_limit = task_config["memory_limit"]  # in MB
+    memory_limit = max(memory_limit, 4)
+    memory_limit = min(memory_limit, 1024)  # still in MB
+    return memory_limit
+
+
 def export_basic_info(polygon: Polygon, ctx: ExportContext):
     if ctx.is_output_only:
         return
@@ -17,17 +43,8 @@ def export_basic_info(polygon: Polygon, ctx: ExportContext):
     if problem_info.output_file == "" or ctx.is_interactive:
         problem_info.output_file = "stdout"
 
-    time_limit = ctx.task_config["time_limit"]  # in seconds
-    time_limit *= 20
-    time_limit = 50 * int(time_limit)  # in milliseconds, but must be multiple of 50
-    time_limit = max(time_limit, 250)
-    time_limit = min(time_limit, 15000)  # polygon constraints
-    problem_info.time_limit = time_limit
-
-    memory_limit = ctx.task_config["memory_limit"]  # in MB
-    memory_limit = max(memory_limit, 4)
-    memory_limit = min(memory_limit, 1024)  # still in MB
-    problem_info.memory_limit = memory_limit
+    problem_info.time_limit = effective_time_limit(ctx)
+    problem_info.memory_limit = polygon_memory_limit(ctx.task_config)
 
     if ctx.is_interactive:
         problem_info.interactive = True
@@ -3,7 +3,9 @@ from pathlib import Path
 
 from polygon_api import Polygon
 
+from lib.cli import ExportAborted, answer, has_answer
 from lib.export_context import ExportContext
+from lib.manifest import content_hash
 
 
 def export_checker(polygon: Polygon, ctx: ExportContext):
@@ -11,8 +13,14 @@ def export_checker(polygon: Polygon, ctx: ExportContext):
         print("""Skipping checker for now. You will likely need to make significant
 changes in the interactor and checker.""")
     elif not os.path.isdir("check") and not os.path.isdir("checker"):
+        digest = content_hash("std::lcmp.cpp")
+        if ctx.manifest.is_current("checker", digest):
+            print("check directory not found, and the checker is already set to std::lcmp.cpp.")
+            return
+
         print("check directory not found. Setting the checker to std::lcmp.cpp...")
         polygon.problem_set_checker(ctx.polygon_id, "std::lcmp.cpp")
+        ctx.manifest.record("checker", digest)
     else:
         Path("polygon/checker").mkdir(parents=True, exist_ok=True)
         ctx.has_custom_checker = True
@@ -21,30 +29,42 @@ to use Polygon's protocol. Put this checker as the only .cpp file in the
 polygon/checker directory.""")
 
         while True:
-            resp = input("""Write 'done' without quotes if done. If you want to skip this
-step for now, write 'skip' without quotes for now. """)
+            resp = answer("checker", lambda: input("""Write 'done' without quotes if done. If you want to skip this
+step for now, write 'skip' without quotes for now. """))
 
             if resp == "done":
                 files = [name for name in os.listdir("polygon/checker")
                          if name.endswith(".cpp")]
                 if len(files) != 1:
+                    if has_answer("checker"):
+                        raise ExportAborted("polygon/checker must contain exactly one .cpp file")
                     print("Too many or too few files in the directory. Try again.")
                     continue
 
                 ctx.custom_checker_path = files[0]
-                print("Uploading file %s to polygon..." % ctx.custom_checker_path)
-                with open(os.path.join("polygon/checker", ctx.custom_checker_path)) as checker_stream:
+                with open(os.path.join("polygon/checker", ctx.custom_checker_path), "rb") as checker_stream:
                     checker_content = checker_stream.read()
-                    polygon.problem_save_file(ctx.polygon_id,
-                                              "source",
-                                              ctx.custom_checker_path,
-                                              checker_content)
+
+                digest = content_hash(ctx.custom_checker_path, checker_content)
+                if ctx.manifest.is_current("checker", digest):
+                    print("Checker %s is unchanged, skipping upload." % ctx.custom_checker_path)
+                    break
+
+                # uploaded as it is, without decoding
+                print("Uploading file %s to polygon..." % ctx.custom_checker_path)
+                polygon.problem_save_file_stream(ctx.polygon_id,
+                                                 "source",
+                                                 ctx.custom_checker_path,
+                                                 checker_content)
 
                 print("Setting file %s as checker..." % ctx.custom_checker_path)
                 polygon.problem_set_checker(ctx.polygon_id, ctx.custom_checker_path)
+                ctx.manifest.record("checker", digest)
                 break
             elif resp == "skip":
                 ctx.custom_checker_path = None
                 break
+            elif has_answer("checker"):
+                raise ExportAborted("checker in the answers file must be done or skip")
             else:
                 print("Unexpected response.")
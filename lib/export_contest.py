@@ -0,0 +1,124 @@
+import os
+import sys
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import List
+
+from polygon_api import Polygon
+
+from lib.cli import ExportAborted
+from lib.export_task import create_polygon_client, export_task, get_polygon_name, load_task_config
+from lib.polygon_client import ResilientPolygon
+from lib.profiling import start_trace, write_trace
+
+# where the trace of a task exported in a worker process goes, relative to the task directory
+TASK_TRACE_PATH = "polygon/trace.json"
+
+# the client of a worker process in a parallel batch export, shared by all tasks it exports
+_worker_polygon: ResilientPolygon = None
+
+
+@dataclass
+class TaskSummary:
+    task_dir: str
+    polygon_name: str = None
+    polygon_id: object = None
+    status: str = "not run"
+    elapsed: float = 0.0
+
+
+# a task is a subdirectory with a task.yaml, or one with a [name].yaml next to it
+def find_tasks(contest_dir: str) -> List[str]:
+    tasks = []
+    for name in sorted(os.listdir(contest_dir)):
+        task_dir = os.path.join(contest_dir, name)
+        if not os.path.isdir(task_dir):
+            continue
+        if os.path.exists(os.path.join(task_dir, "task.yaml")) or \
+                os.path.exists(os.path.join(contest_dir, name + ".yaml")):
+            tasks.append(os.path.abspath(task_dir))
+    return tasks
+
+
+def export_contest(contest_dir: str, args):
+    tasks = find_tasks(contest_dir)
+    if len(tasks) == 0:
+        print("No tasks found in %s." % contest_dir)
+        return []
+
+    print("Found %s tasks: %s" % (len(tasks), ", ".join(Path(task).name for task in tasks)))
+    jobs = max(args.jobs, 1)
+    if jobs == 1:
+        polygon = create_polygon_client(args)
+        summaries = [export_task_in_dir(polygon, task_dir, args, log_to_file=False) for task_dir in tasks]
+        polygon.print_stats()
+    else:
+        # the export depends on the working directory, so parallel tasks need separate processes
+        print("Exporting %s tasks at a time, the output of each goes to polygon/export.log in its directory."
+              % jobs)
+        if args.trace is not None:
+            print("The timing report of each task goes to %s in its directory." % TASK_TRACE_PATH)
+        with ProcessPoolExecutor(max_workers=jobs, initializer=_init_worker, initargs=(args,)) as executor:
+            summaries = list(executor.map(_export_task_in_worker, tasks, [args] * len(tasks)))
+
+    print_summary(summaries)
+    return summaries
+
+
+def _init_worker(args):
+    global _worker_polygon
+    _worker_polygon = create_polygon_client(args)
+
+
+def _export_task_in_worker(task_dir: str, args) -> TaskSummary:
+    # nobody can answer questions in a worker process
+    args.unattended = True
+    # every task gets its own trace, written next to its log
+    if args.trace is not None or args.profile_dir is not None:
+        start_trace(args.profile_dir)
+    summary = export_task_in_dir(_worker_polygon, task_dir, args, log_to_file=True)
+    if args.trace is not None:
+        write_trace(os.path.join(task_dir, TASK_TRACE_PATH))
+    _worker_polygon.print_stats()
+    return summary
+
+
+def export_task_in_dir(polygon: Polygon, task_dir: str, args, log_to_file: bool) -> TaskSummary:
+    summary = TaskSummary(task_dir)
+    original_dir = os.getcwd()
+    original_stdout = sys.stdout
+    start = time.monotonic()
+    try:
+        os.chdir(task_dir)
+        print("=== Exporting %s ===" % task_dir)
+        if log_to_file:
+            Path("polygon").mkdir(exist_ok=True)
+            sys.stdout = open("polygon/export.log", "w", buffering=1)
+
+        summary.polygon_name = get_polygon_name(load_task_config())
+        ctx = export_task(polygon, args)
+        summary.polygon_id = ctx.polygon_id
+        summary.status = "ok"
+    except ExportAborted as ex:
+        summary.status = "aborted: %s" % ex
+    except Exception as ex:
+        print(traceback.format_exc())
+        summary.status = "failed: %s" % (str(ex).splitlines() or [type(ex).__name__])[0]
+    finally:
+        if sys.stdout is not original_stdout:
+            sys.stdout.close()
+            sys.stdout = original_stdout
+        os.chdir(original_dir)
+        summary.elapsed = time.monotonic() - start
+
+    return summary
+
+
+def print_summary(summaries: List[TaskSummary]):
+    print("Summary:")
+    for summary in summaries:
+        print("%-20s %-40s %-10s %6.1fs  %s" % (Path(summary.task_dir).name, summary.polygon_name,
+                                                summary.polygon_id, summary.elapsed, summary.status))
@@ -1,9 +1,11 @@
 from dataclasses import dataclass, field
 from enum import Enum
-from typing import Any, List
+from typing import Any, List, Set
 
 from lib.genfile import TestGroup
+from lib.manifest import Manifest
 from lib.output_only_strategy import OutputOnlyStrategy
+from lib.validation_ledger import ValidationLedger
 
 
 class ScoringMode(Enum):
@@ -19,12 +21,38 @@ class ExportContext:
     scoring_mode: ScoringMode = ScoringMode.GROUP_SUM
     polygon_id: Any = None
     output_only_strategy: OutputOnlyStrategy = None
+    # hashes of what is already uploaded to polygon_id
+    manifest: Manifest = field(default_factory=lambda: Manifest(None))
+    # tests the model solution passed, see lib/validation_ledger.py
+    validation_ledger: ValidationLedger = field(default_factory=ValidationLedger)
+
+    # options from the command line
+    upload_workers: int = 4
+    validation_workers: int = 1
+    validation_keep_going: bool = False
+    # cap the solution's address space at the memory limit while validating
+    validation_memory_cap: bool = False
+    # measure the model solution and offer a time limit based on it
+    calibrate_time_limit: bool = False
+    # time a Python model solution under every installed Python interpreter
+    benchmark_interpreters: bool = False
+    # testlib.h to precompile for checkers that include it
+    testlib_path: str = None
+    # upload generators and a test script instead of the generated tests
+    upload_generators: bool = False
 
     # various bookkeeping fields that need to be kept track of between phases
     gen_file: List[TestGroup] = None
     has_custom_checker: bool = False
     custom_checker_path: str = None
+    # the Language of a Python model solution, once asked
+    python_version: Any = None
+    # the time limit for Polygon in milliseconds, if calibration replaced the one from task.yaml
+    time_limit_override: int = None
     # map polygon test id -> group name
     test_group_by_polygon_id: dict = field(default_factory=dict)
     # map polygon test id -> point value
-    test_points_by_polygon_id: dict = field(default_factory=dict)
\ No newline at end of file
+    test_points_by_polygon_id: dict = field(default_factory=dict)
+    # progress of the export, see lib/checkpoint.py
+    completed_phases: List[str] = field(default_factory=list)
+    uploaded_tests: Set[int] = field(default_factory=set)
\ No newline at end of file
@@ -4,8 +4,10 @@ from pathlib import Path
 
 from polygon_api import Polygon, SolutionTag
 
-from lib.cli import manual, confirm
+from lib.calibrate_time_limit import benchmark_interpreters, calibrate_time_limit
+from lib.cli import ExportAborted, answer, confirm, has_answer, manual
 from lib.export_context import ExportContext
+from lib.manifest import content_hash
 from lib.output_only import upload_output_only_solution
 from lib.validate_solution import validate_solution, RunResult
 
@@ -14,9 +16,10 @@ def export_solution(polygon: Polygon, ctx: ExportContext):
     print("Checking for existing solutions...")
     sols = polygon.problem_solutions(ctx.polygon_id)
     for sol in sols:
-        if sol.tag == SolutionTag.MA:
+        # a main solution uploaded by an earlier run is overwritten or replaced later
+        if sol.tag == SolutionTag.MA and not ctx.manifest.has("solution:" + sol.name):
             manual("""This problem already has a main correct solution. Delete it or change its
-tag before continuing.""")
+tag before continuing.""", "existing_solution_removed")
 
     if ctx.is_output_only:
         upload_output_only_solution(polygon, ctx)
@@ -53,9 +56,20 @@ the task directory.""")
         print("Please choose the correct one by typing its number.")
         print("If you want to not upload a solution (and upload one manually later), type 'X'.")
 
+        def ask():
+            return input("Make your selection: ")
+
+        # the answers file names the solution by path rather than by its number in the list
+        solution_answers = {path: str(i) for i, path in enumerate(solutions)}
+        solution_answers[None] = "X"
+
         model_solution_path = None
         while True:
-            resp = input("Make your selection: ")
+            resp = answer("solution", ask)
+            if has_answer("solution"):
+                if resp not in solution_answers:
+                    raise ExportAborted("solution %s from the answers file was not found" % resp)
+                resp = solution_answers[resp]
             if resp == "X":
                 break
 
@@ -68,30 +82,55 @@ the task directory.""")
                     validation_result = offer_to_validate(model_solution_path, ctx)
                     if validation_result:
                         break
+                    elif has_answer("solution"):
+                        raise ExportAborted("solution %s from the answers file was rejected" % model_solution_path)
+                    model_solution_path = None
             except ValueError:
                 print("Not an integer, try again...")
 
         if model_solution_path is not None:
-            print("Uploading %s as the main correct solution..." % model_solution_path)
+            if ctx.calibrate_time_limit:
+                calibrate_time_limit(polygon, ctx, model_solution_path)
+            if ctx.benchmark_interpreters:
+                benchmark_interpreters(ctx, model_solution_path)
+
             with open(model_solution_path) as solution_stream:
                 solution_content = solution_stream.read()
-                polygon.problem_save_solution(ctx.polygon_id,
-                                              Path(model_solution_path).name,
-                                              solution_content,
-                                              None,  # source_type
-                                              "MA")  # tag
-                print("Done.")
+
+            solution_name = Path(model_solution_path).name
+            key = "solution:" + solution_name
+            digest = content_hash(solution_name, solution_content)
+            if ctx.manifest.is_current(key, digest):
+                print("Main correct solution %s is unchanged, skipping upload." % model_solution_path)
+                return
+
+            for old_key in ctx.manifest.keys("solution:"):
+                if old_key != key:
+                    manual("""An earlier run uploaded %s as the main correct solution. Delete it or
+change its tag before continuing.""" % old_key[len("solution:"):], "existing_solution_removed")
+                    ctx.manifest.forget(old_key)
+
+            print("Uploading %s as the main correct solution..." % model_solution_path)
+            polygon.problem_save_solution(ctx.polygon_id,
+                                          solution_name,
+                                          solution_content,
+                                          None,  # source_type
+                                          "MA")  # tag
+            ctx.manifest.record(key, digest)
+            print("Done.")
 
 
 def offer_to_validate(model_solution_path: str, ctx: ExportContext):
     if ctx.is_interactive:
         return True
 
-    choice = confirm("Do you want to validate this solution?")
+    choice = confirm("Do you want to validate this solution?", "validate_solution")
     if choice:
         # noinspection PyBroadException
         try:
             validate_result = validate_solution(model_solution_path, ctx)
+        except ExportAborted:
+            raise
         except Exception as ex:
             print(traceback.format_exc())
             validate_result = RunResult.NOT_RUN
@@ -100,7 +139,7 @@ def offer_to_validate(model_solution_path: str, ctx: ExportContext):
         if validate_result != RunResult.EXACT_MATCH:
             print("""The output files generated by this solution don't exactly match the ones 
 in the output directory.""")
-            return confirm("Do you want to proceed anyway?")
+            return confirm("Do you want to proceed anyway?", "proceed_after_failed_validation")
         else:
             return True
     else:
@@ -1,9 +1,14 @@
+import json
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from pathlib import Path
+from typing import List
 
 from polygon_api import *
 
+from lib import profiling
 from lib.cli import manual
 from lib.export_context import ExportContext
+from lib.manifest import content_hash, file_hash
 from lib.output_only_strategy import OutputOnlyStrategyType
 from lib.parse_statement import *
 
@@ -22,6 +27,30 @@ def clone_statement(source: ParsedStatement, is_interactive: bool) -> Statement:
     return target
 
 
+def save_statement(polygon: Polygon, ctx: ExportContext, lang: str, statement: Statement):
+    key = "statement:" + lang
+    digest = content_hash(json.dumps(vars(statement), sort_keys=True, default=str))
+    if ctx.manifest.is_current(key, digest):
+        print("Statement for %s is unchanged, skipping upload." % lang)
+        return
+
+    polygon.problem_save_statement(ctx.polygon_id, lang, statement)
+    ctx.manifest.record(key, digest)
+
+
+# converted resources are keyed by the hash of their source, as the conversion output isn't reproducible
+def save_statement_resource(polygon: Polygon, ctx: ExportContext, name: str, path: str, digest: str):
+    key = "resource:" + name
+    if ctx.manifest.is_current(key, digest) and os.path.exists(path):
+        print("Resource %s is unchanged, skipping upload." % name)
+        return
+
+    with open(path, "rb") as resource_stream:
+        print("Uploading resource from %s" % path)
+        polygon.problem_save_statement_resource_stream(ctx.polygon_id, name, resource_stream)
+    ctx.manifest.record(key, digest)
+
+
 def export_statements(polygon: Polygon, ctx: ExportContext):
     if os.path.exists("statement/statement.et.tex"):
         export_statements_tex(polygon, ctx)
@@ -32,46 +61,64 @@ def export_statements(polygon: Polygon, ctx: ExportContext):
 
 
 def export_statements_tex(polygon: Polygon, ctx: ExportContext):
-    with open("statement/statement.et.tex") as statement_et_stream:
-        print("Parsing Estonian statement...")
-        parsed = parse_statement(statement_et_stream, ctx.task_config)
+    locale_map = {"ru": "russian", "en": "other"}
+    translation_paths = {locale: "statement/statement.%s.tex" % locale for locale in locale_map
+                         if os.path.exists("statement/statement.%s.tex" % locale)}
+    parsed_by_path = parse_statements(["statement/statement.et.tex"] + list(translation_paths.values()),
+                                      ctx.task_config)
+    parsed = parsed_by_path["statement/statement.et.tex"]
 
     upload_samples(polygon, ctx, parsed)
-    print("Uploading statement resources...")
-    for figure in parsed.figures:
-        Path("polygon/resources").mkdir(parents=True, exist_ok=True)
-        path = os.path.join("statement", figure)
-        name = figure
-        if should_convert(figure):
-            new_name = get_converted_image_name(figure)
-            new_path = os.path.join("polygon", "resources", new_name)
-            print("Converting from %s to %s" % (path, new_path))
-            convert(path, new_path)
-            path = new_path
-            name = new_name
-
-        with open(path, "rb") as resource_stream:
-            print("Uploading resource from %s" % path)
-            resource_content = resource_stream.read()
-            polygon.problem_save_statement_resource(ctx.polygon_id, name, resource_content)
+    upload_figures(polygon, ctx, parsed.figures)
 
     print("Uploading Estonian statement...")
     pg_statement = clone_statement(parsed, ctx.is_interactive)
-    polygon.problem_save_statement(ctx.polygon_id, "english", pg_statement)
+    save_statement(polygon, ctx, "english", pg_statement)
 
-    locale_map = {"ru": "russian", "en": "other"}
-    for locale in locale_map:
-        translation_path = "statement/statement.%s.tex" % locale
-        if os.path.exists(translation_path):
-            with open(translation_path) as translation_stream:
-                print("Parsing translation for locale %s" % locale)
-                parsed = parse_statement(translation_stream, ctx.task_config)
+    for locale, translation_path in translation_paths.items():
+        pg_statement = clone_statement(parsed_by_path[translation_path], ctx.is_interactive)
+        print("Uploading translation for locale %s" % locale)
+        save_statement(polygon, ctx, locale_map[locale], pg_statement)
+
+    manual("Go to the statement page, check if HTML renders for all translations, fix all errors.",
+           "statements_checked")
+
+
+# figures that need converting are converted in a process pool while the others are uploaded,
+# and each converted figure is uploaded as soon as it's ready
+def upload_figures(polygon: Polygon, ctx: ExportContext, figures: List[str]):
+    print("Uploading statement resources...")
+    Path("polygon/resources").mkdir(parents=True, exist_ok=True)
+    with ProcessPoolExecutor() as executor:
+        conversions = {}
+        for figure in figures:
+            if not should_convert(figure):
+                continue
 
-            pg_statement = clone_statement(parsed, ctx.is_interactive)
-            print("Uploading translation for locale %s" % locale)
-            polygon.problem_save_statement(ctx.polygon_id, locale_map[locale], pg_statement)
+            path = os.path.join("statement", figure)
+            new_name = get_converted_image_name(figure)
+            new_path = os.path.join("polygon", "resources", new_name)
+            digest = conversion_key(path)
+            if ctx.manifest.is_current("resource:" + new_name, digest) and os.path.exists(new_path):
+                print("Resource %s is unchanged, skipping upload." % new_name)
+                continue
+
+            # flushed so that forked workers don't inherit and repeat buffered output
+            print("Converting from %s to %s" % (path, new_path), flush=True)
+            conversions[executor.submit(profiling.call_traced, convert_cached, path, new_path)] = new_name, new_path
 
-    manual("Go to the statement page, check if HTML renders for all translations, fix all errors.")
+        for figure in figures:
+            if not should_convert(figure):
+                path = os.path.join("statement", figure)
+                save_statement_resource(polygon, ctx, figure, path, file_hash(path))
+
+        for future in as_completed(conversions):
+            new_name, new_path = conversions[future]
+            digest = profiling.traced_result(future)
+            if digest is None:
+                print("Not uploading %s as it couldn't be converted." % new_name)
+                continue
+            save_statement_resource(polygon, ctx, new_name, new_path, digest)
 
 
 def upload_samples(polygon: Polygon, ctx: ExportContext, parsed: ParsedStatement):
@@ -90,22 +137,33 @@ def upload_samples(polygon: Polygon, ctx: ExportContext, parsed: ParsedStatement
         if os.path.exists("statement/output%s.txt" % example):
             output_path = "statement/output%s.txt" % example
 
-        with open(input_path) as example_input_stream:
+        # examples are small, but they are uploaded as they are, without decoding
+        with open(input_path, "rb") as example_input_stream:
             example_input = example_input_stream.read()
 
-        with open(output_path) as example_output_stream:
+        with open(output_path, "rb") as example_output_stream:
             example_output = example_output_stream.read()
 
+        test_group = ctx.test_group_by_polygon_id[polygon_test_index]
+        test_points = ctx.test_points_by_polygon_id[polygon_test_index]
+        key = "sample:%s" % polygon_test_index
+        digest = content_hash(example_input, example_output, test_group, test_points)
+        if ctx.manifest.is_current(key, digest):
+            print("Example for polygon test %s is unchanged, skipping." % polygon_test_index)
+            polygon_test_index += 1
+            continue
+
         print("Uploading example input/output to polygon test %s from paths %s and %s" %
               (polygon_test_index, input_path, output_path))
-        polygon.problem_save_test(ctx.polygon_id, "tests", polygon_test_index,
-                                  None,  # test input - not changing
-                                  test_group=ctx.test_group_by_polygon_id[polygon_test_index],
-                                  test_points=ctx.test_points_by_polygon_id[polygon_test_index],
-                                  test_use_in_statements=True,
-                                  test_input_for_statements=example_input,
-                                  test_output_for_statements=example_output,
-                                  verify_input_output_for_statements=False)
+        polygon.problem_save_test_stream(ctx.polygon_id, "tests", polygon_test_index,
+                                         None,  # test input - not changing
+                                         test_group=test_group,
+                                         test_points=test_points,
+                                         test_use_in_statements=True,
+                                         test_input_for_statements=example_input,
+                                         test_output_for_statements=example_output,
+                                         verify_input_output_for_statements=False)
+        ctx.manifest.record(key, digest)
 
         polygon_test_index += 1
 
@@ -117,21 +175,30 @@ def export_statements_pdf(polygon: Polygon, ctx: ExportContext):
 
     Path("polygon/resources").mkdir(parents=True, exist_ok=True)
     locale_map = {"et": "english", "ru": "russian", "en": "other"}
-    for locale in locale_map:
-        pdf_name = "statement.%s.pdf" % locale
-        pdf_path = os.path.join("statement", pdf_name)
-        if os.path.exists(pdf_path):
-            print("Converting PDF for locale %s..." % locale)
-            new_name = get_converted_image_name(pdf_name)
-            new_path = os.path.join("polygon", "resources", new_name)
-            os.system("convert -density 100 %s -append %s" % (pdf_path, new_path))
+    with ProcessPoolExecutor() as executor:
+        # the pages of all locales are rendered at once, each locale is uploaded when its pages are done
+        rasterizations = {}
+        for locale in locale_map:
+            pdf_name = "statement.%s.pdf" % locale
+            pdf_path = os.path.join("statement", pdf_name)
+            if os.path.exists(pdf_path):
+                new_path = os.path.join("polygon", "resources", get_converted_image_name(pdf_name))
+                rasterization = PdfRasterization(pdf_path, new_path)
+                if not ctx.manifest.is_current("resource:" + os.path.basename(new_path), rasterization.key) \
+                        or not os.path.exists(new_path):
+                    print("Converting PDF for locale %s..." % locale, flush=True)
+                    rasterization.start(executor)
+                rasterizations[locale] = rasterization
+
+        for locale, rasterization in rasterizations.items():
+            new_name = os.path.basename(rasterization.target)
+            if rasterization.started:
+                rasterization.result()
 
             print("Uploading PDF for locale %s..." % locale)
-            with open(new_path, "rb") as resource_stream:
-                resource_content = resource_stream.read()
-                polygon.problem_save_statement_resource(ctx.polygon_id, new_name, resource_content)
+            save_statement_resource(polygon, ctx, new_name, rasterization.target, rasterization.key)
 
             statement = Statement()
             statement.name = problem_display_name
             statement.legend = "\\begin{center}\\includegraphics{%s}\\end{center}" % new_name
-            polygon.problem_save_statement(ctx.polygon_id, locale_map[locale], statement)
\ No newline at end of file
+            save_statement(polygon, ctx, locale_map[locale], statement)
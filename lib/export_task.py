@@ -0,0 +1,235 @@
+import json
+import os.path
+import traceback
+from pathlib import Path
+
+import yaml
+from polygon_api import Polygon, PolygonRequestFailedException
+
+from lib.calibrate_time_limit import load_calibrated_time_limit
+from lib.checkpoint import CHECKPOINT_PATH, load_checkpoint, remove_checkpoint, save_checkpoint
+from lib.cli import ExportAborted, answer, confirm, has_answer, load_answers, set_answers
+from lib.export_basic_info import export_basic_info
+from lib.export_checker import export_checker
+from lib.export_context import ExportContext, ScoringMode
+from lib.export_solution import export_solution
+from lib.export_statements import export_statements
+from lib.export_tests import export_tests
+from lib.manifest import Manifest
+from lib.output_only import generate_secret_token
+from lib.output_only_strategy import OutputOnlyStrategyType, OutputOnlyStrategy
+from lib.polygon_client import ConnectionPool, ResilientPolygon
+from lib.profiling import phase_span
+from lib.streaming_upload import StreamingPolygon
+from lib.validation_ledger import ValidationLedger
+
+
+# answers for a single task, overriding the ones given with --answers
+TASK_ANSWERS_PATH = "polygon/answers.yaml"
+
+
+def create_polygon_client(args) -> ResilientPolygon:
+    with open(os.environ["HOME"] + "/.cms2pg/auth.json") as auth_stream:
+        auth = json.load(auth_stream)
+
+    polygon = Polygon(args.api_url, auth["key"], auth["secret"])
+    # enough connections for every upload worker
+    pool = ConnectionPool(size=max(args.upload_workers, 1))
+    if not pool.install():
+        print("Warning: with this version of polygon_api, only file uploads reuse connections to Polygon.")
+    # files are uploaded by StreamingPolygon itself, through the pool
+    polygon = StreamingPolygon(polygon, args.api_url, auth["key"], auth["secret"], session=pool,
+                               buffer_size=max(args.upload_buffer, 1))
+    return ResilientPolygon(polygon, max_retries=args.max_retries, rate_limit=args.rate_limit, pool=pool)
+
+
+# the task in the working directory either has a task.yaml or a [task-short-name].yaml in the parent
+def load_task_config() -> dict:
+    if os.path.exists("task.yaml"):
+        with open("task.yaml") as yaml_stream:
+            return yaml.safe_load(yaml_stream)
+    else:
+        early_short_name = Path(os.getcwd()).name
+        yaml_path = "../" + early_short_name + ".yaml"
+        with open(yaml_path) as yaml_stream:
+            return yaml.safe_load(yaml_stream)
+
+
+def get_polygon_name(task_config: dict) -> str:
+    contest_name = Path(os.getcwd()).parent.name
+    return ("eio-" + contest_name + "-" + task_config["name"]).lower()
+
+
+# exports the task in the working directory. args are the parsed command line options
+def export_task(polygon: Polygon, args) -> ExportContext:
+    ctx = ExportContext()
+    ctx.upload_workers = max(args.upload_workers, 1)
+    ctx.validation_workers = max(args.validate_workers, 1)
+    ctx.validation_keep_going = args.keep_going
+    ctx.validation_memory_cap = args.memory_cap
+    ctx.calibrate_time_limit = args.calibrate
+    ctx.benchmark_interpreters = args.interpreters
+    ctx.testlib_path = args.testlib
+    ctx.upload_generators = args.generators
+    ctx.task_config = load_task_config()
+    set_answers(load_answers([args.answers, TASK_ANSWERS_PATH], ctx.task_config["name"]), args.unattended)
+    if not args.full:
+        ctx.validation_ledger = ValidationLedger.load()
+
+    if args.resume and os.path.exists(CHECKPOINT_PATH):
+        load_checkpoint(ctx)
+        print("Resuming the interrupted export of problem %s. Completed phases: %s" %
+              (ctx.polygon_id, ", ".join(ctx.completed_phases) or "none"))
+        if not args.full:
+            ctx.manifest = Manifest.load(ctx.polygon_id)
+        ctx.manifest.polygon_id = ctx.polygon_id
+    else:
+        start_export(polygon, ctx, args)
+        save_checkpoint(ctx)
+    load_calibrated_time_limit(ctx)
+
+    phases = [
+        ("basic_info", export_basic_info),
+        ("tests", export_tests),
+        ("checker", export_checker),
+        ("solution", export_solution),
+        ("statements", export_statements),
+        ("finish", finish_export),
+    ]
+    for phase_name, phase in phases:
+        if phase_name in ctx.completed_phases:
+            print("Skipping phase %s, it was completed by the interrupted run." % phase_name)
+            continue
+
+        with phase_span(phase_name):
+            phase(polygon, ctx)
+        ctx.completed_phases.append(phase_name)
+        save_checkpoint(ctx)
+
+    remove_checkpoint()
+    return ctx
+
+
+# detects the task type, creates the problem on polygon and asks how to handle output-only tasks
+def start_export(polygon: Polygon, ctx: ExportContext, args):
+    ctx.is_output_only = "output_only" in ctx.task_config and ctx.task_config["output_only"]
+    if ctx.task_config["score_type"] == "GroupSum" or ctx.task_config["score_type"] == "Sum" \
+            or ctx.task_config["score_type"] == "GroupSumConditional" \
+            or ctx.task_config["score_type"] == "GroupSumAtLeastTwo":
+        ctx.scoring_mode = ScoringMode.GROUP_SUM
+    elif ctx.task_config["score_type"] == "GroupMin" or ctx.task_config["score_type"] == "GroupMul":
+        ctx.scoring_mode = ScoringMode.GROUP_MIN
+    else:
+        raise Exception("unknown score_type in task.yaml")
+
+    ctx.is_interactive = os.path.exists("check/batchmanager.cpp") or os.path.exists(
+        "check/interactor.cpp") or os.path.exists("interactor")
+    print("output only: %s, interactive: %s, scoring_mode: %s" %
+          (ctx.is_output_only, ctx.is_interactive, ctx.scoring_mode))
+    if not confirm("Is this correct?", "task_info_correct"):
+        raise ExportAborted("Please fix it.")
+
+    polygon_name = get_polygon_name(ctx.task_config)
+
+    try:
+        print("Creating problem with name %s on polygon..." % polygon_name)
+        problem = polygon.problem_create(polygon_name)
+        ctx.polygon_id = problem.id
+        print("Done.")
+    except PolygonRequestFailedException as ex:
+        if str(ex) == "name: You already have such problem":
+            ret = confirm("""A problem with name %s already exists.
+This script will now overwrite it. Is that ok?""" % polygon_name, "overwrite_existing")
+            if not ret:
+                raise ExportAborted("Not overwriting problem %s." % polygon_name)
+
+            existing = polygon.problems_list(name=polygon_name)
+            if len(existing) != 1:
+                raise Exception("found multiple or no problems with that name")
+
+            ctx.polygon_id = existing[0].id
+            if not args.full:
+                ctx.manifest = Manifest.load(ctx.polygon_id)
+        else:
+            print(traceback.format_exc())
+            raise ExportAborted("Failed to create problem %s." % polygon_name)
+
+    print("Problem id is %s." % ctx.polygon_id)
+    ctx.manifest.polygon_id = ctx.polygon_id
+
+    if ctx.is_output_only:
+        choose_output_only_strategy(ctx)
+
+
+def finish_export(polygon: Polygon, ctx: ExportContext):
+    if ctx.is_interactive:
+        print("""This problem is interactive. You will likely need to make significant changes to the interactor and/or
+checker. Commit the changes and package the problem when done.""")
+    elif ctx.is_output_only:
+        print("""This problem is output-only. You will need to upload the the input package and might need to make other
+changes too. Commit the changes and package the problem when done.""")
+    else:
+        print("Committing changes...")
+        polygon.problem_commit_changes(ctx.polygon_id, minor_changes=True, message="import with cms2pg")
+
+        print("Initiating package build...")
+        # lib doesn't have that method
+        polygon._request_ok_or_raise("problem.buildPackage",
+                                     args={
+                                         "problemId": ctx.polygon_id,
+                                         "full": False,
+                                         "verify": True
+                                     })
+        print("Give READ access to 'codeforces' user. The problem is ready.")
+
+
+def choose_output_only_strategy(ctx: ExportContext):
+    print("""This problem is output-only.
+Supporting an output-only problem on Polygon/Codeforces requires some trickery. We have the following
+strategies for doing that:
+0: MANUAL. This script won't upload any solution or input/output pairs to Polygon.
+1: CONCAT. The "input" files on Polygon (not to be confused with the real input files which are instead
+attachments to the problem) are actually concatenated input + output, with a special separator.
+The fake solution we will upload to Polygon ignores input until the separator, and echoes the rest.
+Considerations:
+- If your checker requires a 'hint' file, you need to use this strategy.
+- Your checker needs to be able to ignore the extra content in the input.
+- People using the archive will partially see the optimal outputs.
+2. TOKEN: The input files on Polygon are authentic. The fake solution we upload to Polygon will output
+an answer of the form '-1 -1 -1 -1 -1 (irrelevant tokens) (secret token)'. Your checker will need to
+accept outputs like this as correct.
+Considerations:
+- Your checker must not require any 'hint' or 'answer' file.
+- Your checker needs to be able to detect answers like this without compromising its correctness on
+other solutions.""")
+
+    strategy_answers = {"manual": "0", "concat": "1", "token": "2"}
+    while True:
+        resp = answer("output_only_strategy", lambda: input("Make your choice [0/1/2]: "))
+        resp = strategy_answers.get(str(resp).lower(), str(resp))
+        if resp == "0":
+            ctx.output_only_strategy = OutputOnlyStrategy(OutputOnlyStrategyType.MANUAL)
+            break
+        elif resp == "1":
+            ctx.output_only_strategy = OutputOnlyStrategy(OutputOnlyStrategyType.CONCAT)
+            while True:
+                separator = str(answer("separator",
+                                       lambda: input("Choose a separator (single character only): ")))
+                if len(separator) == 1:
+                    ctx.output_only_strategy.separator = separator
+                    break
+                elif has_answer("separator"):
+                    raise ExportAborted("separator in the answers file is not a single character")
+                else:
+                    print("Separator is not single-character, try again.")
+            break
+        elif resp == "2":
+            token = generate_secret_token()
+            ctx.output_only_strategy = OutputOnlyStrategy(OutputOnlyStrategyType.TOKEN)
+            ctx.output_only_strategy.secret_token = token
+            print("Your secret token is %s" % token)
+            break
+        elif has_answer("output_only_strategy"):
+            raise ExportAborted("output_only_strategy in the answers file must be manual, concat or token")
+        else:
+            print("Invalid response, try again...")
@@ -1,28 +1,61 @@
+import collections
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
+
 from polygon_api import Polygon, PointsPolicy, FeedbackPolicy
 
+from lib.checkpoint import save_uploaded_test
 from lib.cli import manual
 from lib.export_context import ExportContext, ScoringMode
+from lib.generators import GeneratedTest, export_generators
 from lib.genfile import parse_genfile
+from lib.manifest import content_hash, stream_hash
 from lib.output_only import generate_output_only_concat_input
 from lib.output_only_strategy import OutputOnlyStrategyType
 
 
+# tests uploaded by an earlier run beyond the last test of gen/GEN would stay on Polygon, and
+# the API can't delete tests, so the user is asked to. they are then forgotten, so that a
+# later run with more tests uploads them again
+def forget_removed_tests(ctx: ExportContext, test_count: int):
+    uploaded = {int(key[len("test:"):]) for key in ctx.manifest.keys("test:")} | ctx.uploaded_tests
+    removed = sorted(test_index for test_index in uploaded if test_index > test_count)
+    if len(removed) == 0:
+        return
+
+    manual("""gen/GEN now has %s tests, but more were uploaded by an earlier run.
+Go to the Tests section and DELETE tests %s.""" % (test_count, ", ".join(str(i) for i in removed)),
+           "removed_tests_deleted")
+    for test_index in removed:
+        ctx.manifest.forget("test:%s" % test_index)
+        ctx.manifest.forget("sample:%s" % test_index)
+        ctx.uploaded_tests.discard(test_index)
+
+
 def export_tests(polygon: Polygon, ctx: ExportContext):
     if ctx.is_output_only and ctx.output_only_strategy.strategy_type == OutputOnlyStrategyType.MANUAL:
         print("Skipping test upload as the problem is output-only and the MANUAL strategy was chosen.")
         return
 
-    manual("""The next step requires manual intervention (API doesn't support the first two steps).
+    if ctx.manifest.has("test:1") or len(ctx.uploaded_tests) != 0:
+        print("""Tests were uploaded by an earlier run, only the ones that changed will be uploaded again.
+Do NOT delete the existing tests on Polygon.""")
+    else:
+        manual("""The next step requires manual intervention (API doesn't support the first two steps).
 Go to the Tests section and:
 - UNCHECK 'Tests well-formed' if task may contain unusual input files (e.g. multiple consecutive spaces),
 - SELECT 'Treat points from checker as a percent' under 'Enable points',
 - CHECK 'Enable groups'
-- DELETE any existing tests.""")
+- DELETE any existing tests.""", "tests_prepared")
 
-    print("Uploading tests...")
+    print("Uploading tests with %s workers..." % ctx.upload_workers)
     with open("gen/GEN") as gen_stream:
         ctx.gen_file = parse_genfile(gen_stream)
 
+    # the test index, group and points of every test are decided up front; the maps in ctx
+    # are then complete before any upload (and checkpoint) happens
+    planned_groups = []  # (group, [(filename, test index, points, gen/GEN line)])
     test_index = 1
     for group in ctx.gen_file:
         if ctx.is_output_only and group.points == 0:
@@ -31,6 +64,7 @@ Go to the Tests section and:
 
         remaining_points = group.points * 100  # groupsum only
 
+        planned_tests = []
         for i, filename in enumerate(group.files):
             if ctx.scoring_mode == ScoringMode.GROUP_MIN:
                 points = group.points if i == 0 else 0
@@ -48,27 +82,143 @@ Go to the Tests section and:
             else:
                 assert False
 
-            if ctx.is_output_only and ctx.output_only_strategy.strategy_type == OutputOnlyStrategyType.CONCAT:
-                test_input, description = generate_output_only_concat_input(filename, test_index, ctx)
-            else:
-                file_path = "input/" + filename
-                print("Choosing file %s for test %s" % (file_path, test_index))
-                description = "file %s" % filename
-                with open(file_path) as test_input_stream:
-                    test_input = test_input_stream.read()
-
             ctx.test_group_by_polygon_id[test_index] = group.name
             ctx.test_points_by_polygon_id[test_index] = points
-
-            print("Uploading test...")
-            polygon.problem_save_test(ctx.polygon_id, "tests", test_index, test_input,
-                                      test_group=group.name,
-                                      test_points=points,
-                                      test_description=description)
+            planned_tests.append((filename, test_index, points, group.commands[i]))
             test_index += 1
 
-        print("Saving scoring policy for group %s..." % group.name)
+        planned_groups.append((group, planned_tests))
+
+    forget_removed_tests(ctx, test_index - 1)
+
+    generated_tests = {}
+    if ctx.upload_generators:
+        generated_tests = export_generators(polygon, ctx, [
+            (filename, test_index, group.name, points, command)
+            for group, planned_tests in planned_groups for filename, test_index, points, command in planned_tests])
+
+    # at most this many tests are read into memory or in flight at once
+    window = threading.BoundedSemaphore(2 * ctx.upload_workers)
+    # (group, futures of its tests) for groups whose scoring policy isn't saved yet
+    pending_groups = []
+
+    # futures whose messages haven't been printed yet, in test order
+    unreported = collections.deque()
+
+    with ThreadPoolExecutor(max_workers=ctx.upload_workers) as executor:
+        for group, planned_tests in planned_groups:
+            futures = []
+            for filename, test_index, points, _ in planned_tests:
+                window.acquire()
+                if test_index in generated_tests:
+                    future = executor.submit(save_generated_test, polygon, ctx, test_index, group.name, points,
+                                             generated_tests[test_index])
+                else:
+                    future = executor.submit(upload_test, polygon, ctx, filename, test_index, group.name, points)
+                future.add_done_callback(lambda _: window.release())
+                futures.append(future)
+                unreported.append(future)
+                print_finished_uploads(unreported, wait=False)
+
+            pending_groups.append((group, futures))
+            pending_groups = save_finished_groups(polygon, ctx, pending_groups, wait=False)
+
+        print_finished_uploads(unreported, wait=True)
+        save_finished_groups(polygon, ctx, pending_groups, wait=True)
+
+
+# uploads run in worker threads, which return their messages instead of printing them, so
+# that lines from different threads don't mix. they're printed here, in test order, as far
+# as the uploads have finished (or all of them, if wait is set)
+def print_finished_uploads(unreported: collections.deque, wait: bool):
+    while len(unreported) > 0 and (wait or unreported[0].done()):
+        for message in unreported.popleft().result():
+            print(message)
+
+
+# uploads a test from a worker thread and returns the messages about it
+def upload_test(polygon: Polygon, ctx: ExportContext, filename: str, test_index: int, group_name: str,
+                points: float) -> List[str]:
+    if test_index in ctx.uploaded_tests:
+        return ["Test %s was uploaded by the interrupted run, skipping." % test_index]
+
+    messages = []
+    if ctx.is_output_only and ctx.output_only_strategy.strategy_type == OutputOnlyStrategyType.CONCAT:
+        messages.append("Concatenating input/%s and its output for output-only test %s." % (filename, test_index))
+        test_file, description = generate_output_only_concat_input(filename, test_index, ctx)
+    else:
+        file_path = "input/" + filename
+        messages.append("Choosing file %s for test %s" % (file_path, test_index))
+        description = "file %s" % filename
+        test_file = open(file_path, "rb")
+
+    key = "test:%s" % test_index
+    with test_file:
+        digest = stream_hash(test_file, group_name, points, description)
+        if ctx.manifest.is_current(key, digest):
+            messages.append("Test %s is unchanged, skipping." % test_index)
+            save_uploaded_test(ctx, test_index)
+            return messages
+
+        polygon.problem_save_test_stream(ctx.polygon_id, "tests", test_index, test_file,
+                                         test_group=group_name,
+                                         test_points=points,
+                                         test_description=description)
+        messages.append("Uploaded test %s." % test_index)
+    ctx.manifest.record(key, digest)
+    # the example data attached to this test has to be uploaded again
+    ctx.manifest.forget("sample:%s" % test_index)
+    save_uploaded_test(ctx, test_index)
+    return messages
+
+
+# sets the group and points of a test generated by the test script, from a worker thread.
+# returns the messages about it
+def save_generated_test(polygon: Polygon, ctx: ExportContext, test_index: int, group_name: str, points: float,
+                        generated_test: GeneratedTest) -> List[str]:
+    if test_index in ctx.uploaded_tests:
+        return ["Test %s was saved by the interrupted run, skipping." % test_index]
+
+    key = "test:%s" % test_index
+    if ctx.manifest.is_current(key, generated_test.digest):
+        save_uploaded_test(ctx, test_index)
+        return ["Generated test %s is unchanged, skipping." % test_index]
+
+    polygon.problem_save_test(ctx.polygon_id, "tests", test_index,
+                              None,  # test input - generated by the script
+                              test_group=group_name,
+                              test_points=points,
+                              test_description=generated_test.description)
+    ctx.manifest.record(key, generated_test.digest)
+    ctx.manifest.forget("sample:%s" % test_index)
+    save_uploaded_test(ctx, test_index)
+    return ["Saved group and points of generated test %s." % test_index]
+
+
+# saves the scoring policy of every pending group whose tests have all been uploaded.
+# if wait is set, blocks until that is true for all pending groups.
+# returns the groups that are still pending
+def save_finished_groups(polygon: Polygon, ctx: ExportContext, pending_groups, wait: bool):
+    still_pending = []
+    for group, futures in pending_groups:
+        if not wait and not all(future.done() for future in futures):
+            still_pending.append((group, futures))
+            continue
+
+        for future in futures:
+            future.result()  # re-raises upload errors
+
         policy = PointsPolicy.COMPLETE_GROUP if ctx.scoring_mode == ScoringMode.GROUP_MIN else PointsPolicy.EACH_TEST
+        key = "test_group:%s" % group.name
+        digest = content_hash(policy.name, FeedbackPolicy.COMPLETE.name)
+        if ctx.manifest.is_current(key, digest):
+            print("Scoring policy for group %s is unchanged, skipping." % group.name)
+            continue
+
+        print("Saving scoring policy for group %s..." % group.name)
         polygon.problem_save_test_group(ctx.polygon_id, "tests", group.name,
                                         points_policy=policy,
                                         feedback_policy=FeedbackPolicy.COMPLETE)
+        ctx.manifest.record(key, digest)
+
+    return still_pending
@@ -0,0 +1,235 @@
+import filecmp
+import os
+import re
+import subprocess
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from polygon_api import Polygon
+
+from lib import profiling
+from lib.build_cache import compile_cached
+from lib.export_context import ExportContext
+from lib.manifest import content_hash, file_hash, stream_hash
+
+GENERATOR_DIR = "gen"
+GENERATOR_WORKING_DIR = "polygon/working/generators"
+# seconds a generator may run when checking that it reproduces a test
+GENERATOR_TIMEOUT = 60
+
+# how generators are compiled locally by extension: (compiler, flags), None if interpreted
+GENERATOR_COMPILERS = {
+    ".cpp": ("g++", ["-O2"]),
+    ".c": ("gcc", ["-O2", "-lm"]),
+    ".py": None,
+}
+
+# C and C++ calls that give different results with Polygon's (Windows) C library or on every run
+_NOT_PORTABLE = re.compile(r"\b(s?rand|time|clock)\s*\(|\brandom_device\b")
+# shell syntax that a Polygon script line can't express
+_SHELL_SYNTAX = re.compile(r"[|&;<>`$()*?'\"\\]")
+# sources in gen/ that are something else, unless a gen/GEN line runs them
+_NOT_GENERATOR = re.compile(r"valid|^val$|check|interact|grader|manager", re.IGNORECASE)
+
+
+@dataclass
+class Generator:
+    name: str  # the name in Polygon's test script, i.e. the file name without extension
+    path: str
+    command: List[str]  # runs it locally, without the arguments
+
+
+@dataclass
+class GeneratedTest:
+    script_line: str
+    description: str
+    digest: str
+
+
+# the name of the program a gen/GEN line starts with, e.g. gen for "./gen.py 10 5"
+def command_name(command: str) -> str:
+    tokens = command.split()
+    return os.path.splitext(os.path.basename(tokens[0]))[0] if len(tokens) > 0 else ""
+
+
+# every generator source in gen/, compiled. generators that can't be used are None: those
+# that don't compile or that use functions which would generate different tests on Polygon.
+# validators, checkers and the like are left out, unless gen/GEN runs them
+def find_generators(ctx: ExportContext) -> Dict[str, Optional[Generator]]:
+    Path(GENERATOR_WORKING_DIR).mkdir(parents=True, exist_ok=True)
+    named = {command_name(command) for group in ctx.gen_file for command in group.commands if command is not None}
+    generators = {}
+    for filename in sorted(os.listdir(GENERATOR_DIR)):
+        name, ext = os.path.splitext(filename)
+        if ext not in GENERATOR_COMPILERS:
+            continue
+        if name not in named and _NOT_GENERATOR.search(name) is not None:
+            print("%s doesn't look like a generator, ignoring it." % os.path.join(GENERATOR_DIR, filename))
+            continue
+
+        path = os.path.join(GENERATOR_DIR, filename)
+        generators[name] = None
+        if GENERATOR_COMPILERS[ext] is None:
+            generators[name] = Generator(name, path, ["python3", os.path.abspath(path)])
+            continue
+
+        with open(path, errors="replace") as source_stream:
+            if _NOT_PORTABLE.search(source_stream.read()) is not None:
+                print("Generator %s uses rand(), time() or similar, its tests will be uploaded as files." % path)
+                continue
+
+        compiler, flags = GENERATOR_COMPILERS[ext]
+        if ctx.testlib_path is not None:
+            flags = flags + ["-I", os.path.dirname(os.path.abspath(ctx.testlib_path))]
+        binary_path = os.path.join(GENERATOR_WORKING_DIR, name)
+        try:
+            compile_cached(compiler, flags, path, binary_path)
+        except subprocess.CalledProcessError:
+            print("Compiling generator %s failed, its tests will be uploaded as files." % path)
+            continue
+        generators[name] = Generator(name, path, [os.path.abspath(binary_path)])
+
+    return generators
+
+
+# the generator that gen/GEN lines with only arguments are run with: the only usable one
+# in gen/. None if there are none or several, then those lines' tests are uploaded as files
+def default_generator(generators: Dict[str, Optional[Generator]]) -> Optional[Generator]:
+    usable = sorted(name for name, generator in generators.items() if generator is not None)
+    if len(usable) == 1:
+        return generators[usable[0]]
+
+    if len(usable) > 1:
+        print("gen/GEN has lines that don't start with a generator, but there are several in %s (%s). "
+              "Their tests will be uploaded as files." % (GENERATOR_DIR, ", ".join(usable)))
+    return None
+
+
+# the generator and arguments of a gen/GEN line: either the line starts with the generator
+# (e.g. "gen 10 5" or "./gen.py 10 5"), or it only has the arguments of the default
+# generator. None if the line can't be a Polygon script line
+def translate_command(command: str, generators: Dict[str, Optional[Generator]], default: Optional[Generator]) \
+        -> Optional[Tuple[Generator, List[str]]]:
+    if _SHELL_SYNTAX.search(command) is not None:
+        return None
+
+    tokens = command.split()
+    first = command_name(command)
+    if first in generators:
+        generator, args = generators[first], tokens[1:]
+    elif default is not None:
+        generator, args = default, tokens
+    else:
+        return None
+
+    return None if generator is None else (generator, args)
+
+
+# checks run concurrently, so each generator runs in a directory of its own, in case it writes
+# files there
+def reproduces_test(generator: Generator, args: List[str], input_path: str) -> bool:
+    with tempfile.TemporaryDirectory(dir=GENERATOR_WORKING_DIR) as run_dir:
+        output_path = os.path.join(run_dir, "output")
+        with open(output_path, "wb") as output_stream:
+            try:
+                result = profiling.run(generator.command + args, stdin=subprocess.DEVNULL, stdout=output_stream,
+                                       stderr=subprocess.DEVNULL, cwd=run_dir, timeout=GENERATOR_TIMEOUT)
+            except subprocess.TimeoutExpired:
+                return False
+        return result.returncode == 0 and filecmp.cmp(output_path, input_path, shallow=False)
+
+
+# decides which tests Polygon can generate, uploads their generators and the test script.
+# planned_tests holds (filename, test index, group name, points, gen/GEN line) for every
+# test. a test is generated on Polygon if its line translates to a script line and the
+# generator reproduces the input file exactly when run locally; the others are left to be
+# uploaded as files. returns {test index: GeneratedTest}
+def export_generators(polygon: Polygon, ctx: ExportContext, planned_tests: List[Tuple]) -> Dict[int, GeneratedTest]:
+    generators = find_generators(ctx)
+    if len(generators) == 0:
+        print("No generators found in %s, uploading all tests as files." % GENERATOR_DIR)
+
+    generator_hashes = {name: file_hash(generator.path) for name, generator in generators.items()
+                        if generator is not None}
+    default = None
+    if any(command is not None and command_name(command) not in generators for *_, command in planned_tests):
+        default = default_generator(generators)
+
+    # runs in worker threads, so the message about the check is returned rather than printed
+    def check(planned_test) -> Tuple[Optional[Tuple[Generator, GeneratedTest]], Optional[str]]:
+        filename, test_index, group_name, points, command = planned_test
+        translation = translate_command(command, generators, default) if command is not None else None
+        if translation is None:
+            return None, None
+
+        generator, args = translation
+        input_path = os.path.join("input", filename)
+        script_line = " ".join([generator.name] + args + [">", str(test_index)])
+        description = "gen/GEN: %s" % command
+        with open(input_path, "rb") as input_stream:
+            input_digest = stream_hash(input_stream)
+        digest = content_hash(script_line, generator_hashes[generator.name], input_digest, group_name, points,
+                              description)
+        # the manifest remembers tests that were checked and generated before
+        message = None
+        if not ctx.manifest.is_current("test:%s" % test_index, digest):
+            if not reproduces_test(generator, args, input_path):
+                return None, "Generator %s doesn't reproduce %s exactly, it will be uploaded as a file." \
+                       % (generator.name, input_path)
+            message = "Generator %s reproduces test %s." % (generator.name, test_index)
+        return (generator, GeneratedTest(script_line, description, digest)), message
+
+    generated_tests = {}
+    used_generators = {}
+    with ThreadPoolExecutor(max_workers=ctx.upload_workers) as executor:
+        for planned_test, (result, message) in zip(planned_tests, executor.map(check, planned_tests)):
+            if message is not None:
+                print(message)
+            if result is not None:
+                generator, generated_test = result
+                generated_tests[planned_test[1]] = generated_test
+                used_generators[generator.name] = generator
+
+    print("%s of %s tests will be generated on Polygon." % (len(generated_tests), len(planned_tests)))
+    if len(used_generators) > 0:
+        upload_generator_files(polygon, ctx, list(used_generators.values()))
+
+    script = "".join("%s\n" % generated_tests[test_index].script_line for test_index in sorted(generated_tests))
+    digest = content_hash(script)
+    if ctx.manifest.is_current("script", digest) or (len(script) == 0 and not ctx.manifest.has("script")):
+        print("The test script is unchanged, skipping upload.")
+    else:
+        print("Uploading the test script...")
+        polygon.problem_save_script(ctx.polygon_id, "tests", script)
+        ctx.manifest.record("script", digest)
+        # Polygon generates the tests again, so their groups and points are saved again too
+        for test_index in generated_tests:
+            ctx.manifest.forget("test:%s" % test_index)
+            ctx.uploaded_tests.discard(test_index)
+
+    return generated_tests
+
+
+# uploads the generator sources and the headers next to them (testlib.h is provided by Polygon)
+def upload_generator_files(polygon: Polygon, ctx: ExportContext, generators: List[Generator]):
+    files = [("source", generator.path) for generator in generators]
+    files += [("resource", os.path.join(GENERATOR_DIR, filename)) for filename in sorted(os.listdir(GENERATOR_DIR))
+              if filename.endswith(".h") and filename != "testlib.h"]
+
+    for file_type, path in files:
+        filename = os.path.basename(path)
+        with open(path, "rb") as file_stream:
+            content = file_stream.read()
+
+        key = "generator:%s" % filename
+        digest = content_hash(file_type, filename, content)
+        if ctx.manifest.is_current(key, digest):
+            print("Generator file %s is unchanged, skipping upload." % filename)
+            continue
+
+        print("Uploading generator file %s..." % filename)
+        polygon.problem_save_file_stream(ctx.polygon_id, file_type, filename, content)
+        ctx.manifest.record(key, digest)
@@ -1,4 +1,4 @@
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from typing import List
 
 
@@ -7,6 +7,8 @@ class TestGroup:
     points: int
     files: List[str]
     name: str
+    # the gen/GEN line of each test in files
+    commands: List[str] = field(default_factory=list)
 
 
 def parse_genfile(genfile_stream) -> List[TestGroup]:
@@ -33,6 +35,7 @@ def parse_genfile(genfile_stream) -> List[TestGroup]:
             continue
         else:
             groups[-1].files.append("input" + str(unused_id) + ".txt")
+            groups[-1].commands.append(line)
             unused_id += 1
 
     return groups
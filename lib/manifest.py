@@ -0,0 +1,101 @@
+import hashlib
+import json
+import os
+import threading
+from pathlib import Path
+from typing import Any, BinaryIO
+
+MANIFEST_PATH = "polygon/manifest.json"
+
+
+# size of the blocks stream_hash reads
+HASH_CHUNK_SIZE = 1 << 20
+
+
+def content_hash(*parts) -> str:
+    hasher = hashlib.sha256()
+    _update_hash(hasher, parts)
+    return hasher.hexdigest()
+
+
+def _update_hash(hasher, parts):
+    # strings are hashed as utf-8, everything else that isn't bytes via str().
+    # parts are length-prefixed so that ("ab", "c") and ("a", "bc") differ
+    for part in parts:
+        if part is None:
+            data = b"\x00none"
+        elif isinstance(part, bytes):
+            data = part
+        elif isinstance(part, str):
+            data = part.encode("utf-8")
+        else:
+            data = str(part).encode("utf-8")
+        hasher.update(str(len(data)).encode("ascii") + b":")
+        hasher.update(data)
+
+
+# content_hash(content, *extra_parts) for content read from a binary file, block by block
+def stream_hash(stream: BinaryIO, *extra_parts) -> str:
+    hasher = hashlib.sha256()
+    stream.seek(0)
+    hasher.update(str(os.fstat(stream.fileno()).st_size).encode("ascii") + b":")
+    for chunk in iter(lambda: stream.read(HASH_CHUNK_SIZE), b""):
+        hasher.update(chunk)
+    _update_hash(hasher, extra_parts)
+    return hasher.hexdigest()
+
+
+def file_hash(path: str, *extra_parts) -> str:
+    with open(path, "rb") as stream:
+        return content_hash(stream.read(), *extra_parts)
+
+
+# records a content hash of everything uploaded to a Polygon problem, so
+# that re-exporting an existing problem only uploads what changed. keys are
+# of the form "kind:name", e.g. "test:12" or "statement:russian"
+class Manifest:
+    def __init__(self, polygon_id: Any, entries: dict = None, path: str = MANIFEST_PATH):
+        self.polygon_id = polygon_id
+        self.entries = entries if entries is not None else {}
+        self.path = path
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def load(polygon_id: Any, path: str = MANIFEST_PATH) -> "Manifest":
+        # a manifest written for a different problem tells nothing about this one
+        if os.path.exists(path):
+            with open(path) as manifest_stream:
+                data = json.load(manifest_stream)
+            if str(data.get("polygon_id")) == str(polygon_id):
+                return Manifest(polygon_id, data.get("entries", {}), path)
+        return Manifest(polygon_id, path=path)
+
+    def is_current(self, key: str, digest: str) -> bool:
+        with self._lock:
+            return self.entries.get(key) == digest
+
+    def has(self, key: str) -> bool:
+        with self._lock:
+            return key in self.entries
+
+    def keys(self, prefix: str = "") -> list:
+        with self._lock:
+            return [key for key in self.entries if key.startswith(prefix)]
+
+    def record(self, key: str, digest: str):
+        with self._lock:
+            self.entries[key] = digest
+            self._save()
+
+    def forget(self, key: str):
+        with self._lock:
+            if self.entries.pop(key, None) is not None:
+                self._save()
+
+    def _save(self):
+        Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as manifest_stream:
+            json.dump({"polygon_id": self.polygon_id, "entries": self.entries},
+                      manifest_stream, indent=2, sort_keys=True)
+        os.replace(tmp_path, self.path)
@@ -0,0 +1,102 @@
+import os
+import resource
+import subprocess
+import threading
+import time
+from dataclasses import dataclass
+from typing import List, Optional
+
+from lib import profiling
+
+# how often the memory of a running program is sampled, in seconds
+MEMORY_SAMPLE_INTERVAL = 0.005
+
+
+# resources used by a single run of a program
+@dataclass
+class RunMeasurement:
+    returncode: int
+    cpu_time: float  # user + system, in seconds
+    wall_time: float  # in seconds
+    # the program's own peak, sampled from /proc while it runs (see _sample_peak_rss). a peak
+    # reached just before it exits can be missed, so this is a lower bound; 0 if it exited
+    # before the first sample
+    peak_rss_kb: int
+    timed_out: bool = False
+
+
+# caps the address space of the child between fork and exec, so allocations beyond it fail
+def _address_space_limiter(memory_limit_mb: int):
+    limit = memory_limit_mb * 1024 * 1024
+    return lambda: resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+
+# the VmHWM (peak resident set) of a process in KB, None once it has exited
+def _vm_hwm_kb(pid: int) -> Optional[int]:
+    try:
+        with open("/proc/%s/status" % pid) as status_stream:
+            for line in status_stream:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+# samples the peak memory of pid into peak[0] until it exits or stop is set. wait4's ru_maxrss
+# can't be used: the forked child starts as a copy of this script, and the kernel keeps the
+# peak of that copy across exec, so even a trivial program "uses" as much memory as we do.
+# VmHWM starts over at exec
+def _sample_peak_rss(pid: int, peak: List[int], stop: threading.Event):
+    while not stop.is_set():
+        hwm = _vm_hwm_kb(pid)
+        if hwm is None:
+            return
+        peak[0] = max(peak[0], hwm)
+        stop.wait(MEMORY_SAMPLE_INTERVAL)
+
+
+# runs a program like subprocess.run, killing it after timeout seconds of wall time, and
+# measures its CPU time with wait4 and its memory by sampling. memory_limit_mb caps its
+# address space with setrlimit, so allocations beyond it fail
+def run_measured(args: List[str], stdin=None, stdout=None, stderr=subprocess.DEVNULL, cwd: str = None,
+                 timeout: float = None, memory_limit_mb: int = None) -> RunMeasurement:
+    start = time.monotonic()
+    process = subprocess.Popen(args, stdin=stdin, stdout=stdout, stderr=stderr, cwd=cwd,
+                               preexec_fn=_address_space_limiter(memory_limit_mb) if memory_limit_mb else None)
+    # Popen returns once the program is exec'd, so every sample is of the program itself
+    peak = [0]
+    stop_sampling = threading.Event()
+    sampler = threading.Thread(target=_sample_peak_rss, args=(process.pid, peak, stop_sampling), daemon=True)
+    sampler.start()
+    timed_out = threading.Event()
+
+    def kill():
+        timed_out.set()
+        process.kill()
+
+    timer = None
+    if timeout is not None:
+        timer = threading.Timer(timeout, kill)
+        timer.start()
+    try:
+        # the program stays a zombie until wait4, so the sampler can't read another process
+        # that got its pid
+        os.waitid(os.P_PID, process.pid, os.WEXITED | os.WNOWAIT)
+        stop_sampling.set()
+        sampler.join()
+        # wait4 reports the resources of this child alone, unlike getrusage(RUSAGE_CHILDREN)
+        _, status, rusage = os.wait4(process.pid, 0)
+    finally:
+        stop_sampling.set()
+        if timer is not None:
+            timer.cancel()
+    wall_time = time.monotonic() - start
+    process.returncode = os.waitstatus_to_exitcode(status)
+
+    measurement = RunMeasurement(process.returncode, rusage.ru_utime + rusage.ru_stime, wall_time,
+                                 peak[0], timed_out.is_set())
+    profiling.record("subprocess", os.path.basename(str(args[0])), start, wall_time,
+                     args=[str(arg) for arg in args], returncode=measurement.returncode,
+                     cpu_time=round(measurement.cpu_time, 6), peak_rss_kb=measurement.peak_rss_kb)
+    return measurement
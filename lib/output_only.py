@@ -1,32 +1,57 @@
 import random
 import string
-from typing import Tuple
+import tempfile
+from typing import BinaryIO, Tuple
 
 from polygon_api import Polygon
 
+from lib.cli import ExportAborted
 from lib.export_context import ExportContext
+from lib.manifest import content_hash
 from lib.output_only_strategy import OutputOnlyStrategyType
 
 
+# size of the blocks in which CONCAT tests are copied
+CHUNK_SIZE = 1 << 20
+
+
 def generate_secret_token() -> str:
     return "".join(random.choice(string.ascii_letters + string.digits) for _ in range(16))
 
 
-def generate_output_only_concat_input(filename: str, test_index: int, ctx: ExportContext) -> Tuple[str, str]:
+# writes the input, the separator and the output of a test into a temporary file block by block
+# and returns the file and a description of the test. the fake solution echoes everything after
+# the first separator, so the separator may occur in the output but not in the input
+def generate_output_only_concat_input(filename: str, test_index: int, ctx: ExportContext) -> Tuple[BinaryIO, str]:
     authentic_input_path = "input/" + filename
     authentic_output_path = "output/" + filename.replace("input", "output")
-    print("Concatenating %s and %s for output-only test %s."
-          % (authentic_input_path, authentic_output_path, test_index))
-
-    with open(authentic_input_path) as authentic_input_stream:
-        authentic_input = authentic_input_stream.read()
 
-    with open(authentic_output_path) as authentic_output_stream:
-        authentic_output = authentic_output_stream.read()
-
-    test_content = authentic_input + ctx.output_only_strategy.separator + authentic_output
+    # the files are copied as bytes, so they don't need to be valid UTF-8
+    separator = ctx.output_only_strategy.separator.encode("utf-8")
+    test_file = tempfile.TemporaryFile()
+    try:
+        with open(authentic_input_path, "rb") as authentic_input_stream:
+            tail = b""
+            for chunk in iter(lambda: authentic_input_stream.read(CHUNK_SIZE), b""):
+                # an encoded separator can be longer than a byte, and so split between chunks
+                if separator in tail + chunk:
+                    raise ExportAborted("The separator %s occurs in %s. Choose another separator and export "
+                                        "again without --resume." % (ctx.output_only_strategy.separator,
+                                                                     authentic_input_path))
+                tail = chunk[-(len(separator) - 1):] if len(separator) > 1 else b""
+                test_file.write(chunk)
+
+        test_file.write(separator)
+        with open(authentic_output_path, "rb") as authentic_output_stream:
+            for chunk in iter(lambda: authentic_output_stream.read(CHUNK_SIZE), b""):
+                test_file.write(chunk)
+    except BaseException:
+        test_file.close()
+        raise
+
+    test_file.seek(0)
     description = "fake input: concatenated %s and %s" % (filename, filename.replace("input", "output"))
-    return test_content, description
+    return test_file, description
 
 
 def upload_output_only_solution(polygon: Polygon, ctx: ExportContext):
@@ -44,12 +69,18 @@ we will skip uploading a solution.""")
     else:
         assert False
 
+    digest = content_hash("fakesol.cpp", fake_sol)
+    if ctx.manifest.is_current("solution:fakesol.cpp", digest):
+        print("The fake solution is unchanged, skipping upload.")
+        return
+
     print("Uploading the fake solution...")
     polygon.problem_save_solution(ctx.polygon_id,
                                   "fakesol.cpp",
                                   fake_sol,
                                   None,  # source_type
                                   "MA")  # tag
+    ctx.manifest.record("solution:fakesol.cpp", digest)
     print("Done.")
 
 
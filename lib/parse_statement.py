@@ -1,11 +1,20 @@
-from typing import TextIO, Dict
+import json
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Callable, TextIO, Dict, List
 
 from TexSoup import TexSoup
 from TexSoup.data import *
+from lib import conversions, profiling
 from lib.conversions import *
+from lib.manifest import content_hash
 
 import re
 
+STATEMENT_CACHE_DIR = "polygon/statement-cache"
+
+_VERB = re.compile(r"\\verb(?![a-zA-Z])\*?")
+
 _NAME = "name"
 _LEGEND = "legend"
 _INPUT = "input"
@@ -65,73 +74,218 @@ class ParsedStatement:
     def notes(self) -> str:
         return self.sections[_NOTES]
 
+    def to_json(self) -> dict:
+        return {"sections": self.sections, "figures": self.figures, "examples": self.examples}
+
+    @staticmethod
+    def from_json(data: dict):
+        statement = ParsedStatement()
+        statement.sections.update(data["sections"])
+        statement.figures = data["figures"]
+        statement.examples = data["examples"]
+        return statement
+
+
+# the result of parsing depends on the source, the I/O file names, which figure files exist
+# (figures can be referenced without an extension) and this parser itself
+def statement_cache_key(path: str, task_config: Dict) -> str:
+    with open(path, "rb") as statement_stream:
+        source = statement_stream.read()
+    parser = []
+    for parser_path in [__file__, conversions.__file__]:
+        with open(parser_path, "rb") as parser_stream:
+            parser.append(parser_stream.read())
+    statement_files = sorted(os.listdir(os.path.dirname(path) or "."))
+    return content_hash(source, task_config.get("infile"), task_config.get("outfile"), *parser,
+                        *statement_files)
+
+
+def _parse_statement_file(path: str, task_config: Dict) -> ParsedStatement:
+    with open(path) as statement_stream:
+        return parse_statement(statement_stream, task_config)
+
+
+# parses the statements at paths, reusing results from earlier runs where nothing changed. if
+# several statements need parsing, each is parsed in its own process. returns {path: statement}.
+# the cache only keeps the statements of the last call
+def parse_statements(paths: List[str], task_config: Dict,
+                     cache_dir: str = STATEMENT_CACHE_DIR) -> Dict[str, ParsedStatement]:
+    statements = {}
+    misses = {}
+    keys = {path: statement_cache_key(path, task_config) for path in paths}
+    for path in paths:
+        cached_path = os.path.join(cache_dir, keys[path] + ".json")
+        if os.path.exists(cached_path):
+            print("Using cached parse of %s." % path)
+            with open(cached_path) as cached_stream:
+                statements[path] = ParsedStatement.from_json(json.load(cached_stream))
+        else:
+            misses[path] = cached_path
+
+    if len(misses) == 1:
+        path = next(iter(misses))
+        print("Parsing %s..." % path)
+        with profiling.span("parse", os.path.basename(path)):
+            statements[path] = _parse_statement_file(path, task_config)
+    elif len(misses) > 1:
+        print("Parsing %s..." % ", ".join(misses), flush=True)
+        with profiling.span("parse", ", ".join(os.path.basename(path) for path in misses)):
+            with ProcessPoolExecutor(max_workers=len(misses)) as executor:
+                futures = {path: executor.submit(_parse_statement_file, path, task_config) for path in misses}
+                for path, future in futures.items():
+                    statements[path] = future.result()
+
+    Path(cache_dir).mkdir(parents=True, exist_ok=True)
+    for path, cached_path in misses.items():
+        tmp_path = cached_path + ".tmp"
+        with open(tmp_path, "w") as cached_stream:
+            json.dump(statements[path].to_json(), cached_stream)
+        os.replace(tmp_path, cached_path)
+
+    for name in os.listdir(cache_dir):
+        if os.path.splitext(name)[0] not in keys.values():
+            os.remove(os.path.join(cache_dir, name))
+
+    return {path: statements[path] for path in paths}
+
+
+# rewrite rules by the name of the command or environment they apply to. transform() walks
+# the tree once and calls the rule of every node that has one, so adding a rule doesn't add a
+# traversal. rules get the node and the _Transform holding the statement being built
+_RULES: Dict[str, Callable] = {}
+
+
+def rule(*names: str):
+    def register(function: Callable):
+        for name in names:
+            _RULES[name] = function
+        return function
+
+    return register
+
+
+@dataclass
+class _Transform:
+    task_config: Dict
+    statement: ParsedStatement
+    yl: Any = None  # the yl or ylx environment
+    deleted: List = field(default_factory=list)
+
+
+def transform(soup: TexNode, task_config: Dict) -> _Transform:
+    state = _Transform(task_config, ParsedStatement())
+    # collected first, as rules change the tree
+    nodes = [node for node in soup.descendants if getattr(node, "name", None) in _RULES]
+    for node in nodes:
+        _RULES[node.name](node, state)
+    _delete_nodes(state.deleted)
+    return state
+
+
+# these formatting tags are unnecessary for non-pdf output
+@rule("vspace", "hspace", "pagebreak", "clearpage")
+def _delete(node, state: _Transform):
+    state.deleted.append(node)
+
+
+# TexSoup's delete() finds the node among its siblings by comparing them as strings, which
+# is slow in long statements. nodes are instead removed from each parent in one go, by identity
+def _delete_nodes(nodes: List):
+    deleted_by_parent = {}
+    for node in nodes:
+        parent = node.parent
+        if parent.expr._supports_contents():
+            deleted_by_parent.setdefault(id(parent.expr), (parent.expr, set()))[1].add(id(node.expr))
+        else:
+            node.delete()
+
+    for parent_expr, deleted in deleted_by_parent.values():
+        parent_expr._contents = [expr for expr in parent_expr._contents if id(expr) not in deleted]
+
+
+# xitem and xenum are defined in our sty file - change them to regular itemizes and enumerates
+@rule("xitem")
+def _xitem(node, state: _Transform):
+    node.name = "itemize"
+
+
+@rule("xenum")
+def _xenum(node, state: _Transform):
+    node.name = "enumerate"
+
+
+# sisf and valf need to be changed to the actual file names
+@rule("sisf")
+def _sisf(node, state: _Transform):
+    node.name = "t"
+    node.args.append("{%s}" % state.task_config["infile"])
+
+
+@rule("valf")
+def _valf(node, state: _Transform):
+    node.name = "t"
+    node.args.append("{%s}" % state.task_config["outfile"])
+
+
+# polygon does not support quote. use an itemize with a single item instead
+@rule("quote")
+def _quote(node, state: _Transform):
+    node.name = "itemize"
+    node.insert(0, TexCmd("item"))
+
+
+# wrapfigure and figure are unsupported. use center instead
+@rule("wrapfigure", "figure")
+def _figure(node, state: _Transform):
+    node.name = "center"
+    argc = len(node.args)  # remove all [h] etc
+    for i in range(argc):
+        node.args.pop(0)
+
+
+# verb is not supported. transform it to polygon's own \t{...} instead
+@rule("verb")
+def _verb(node, state: _Transform):
+    node.name = "t"
+
+
+# figures need to be uploaded. record all figures and make them available
+# in the statement return object
+@rule("includegraphics")
+def _includegraphics(node, state: _Transform):
+    for arg in node.args:
+        if arg.name == "BraceGroup":
+            resolved = resolve_if_no_extension(arg.string)
+            if resolved is None:
+                print("Failed to resolve file %s" % arg.string)
+                continue
+
+            state.statement.figures.append(resolved)
+            arg.string = get_converted_image_name(resolved)
+
+
+# examples need to all have "custom output" and in case of OO/interactive
+# problems, also "custom input". we need to upload all those to polygon.
+# record the numbers of examples used
+@rule("nde", "ndex", "ndey")
+def _example(node, state: _Transform):
+    state.statement.examples.append(node.args[0].string)
+
+
+@rule("yl", "ylx")
+def _task_environment(node, state: _Transform):
+    if state.yl is None:
+        state.yl = node
+
 
 def parse_statement(raw_statement: TextIO, task_config: Dict):
     raw_statement = norm_verb_args(raw_statement)
     soup = TexSoup(raw_statement)
+    state = transform(soup, task_config)
+    statement = state.statement
 
-    # these formatting tags are unnecessary for non-pdf output
-    unneeded = soup.find_all(["vspace", "hspace", "pagebreak", "clearpage"])
-    for un in unneeded:
-        un.delete()
-
-    # xitem and xenum are defined in our sty file - change them to regular itemizes and enumerates
-    for xitem in soup.find_all("xitem"):
-        xitem.name = "itemize"
-    for xenum in soup.find_all("xenum"):
-        xenum.name = "enumerate"
-
-    # sisf and valf need to be changed to the actual file names
-    for sisf in soup.find_all("sisf"):
-        sisf.name = "t"
-        sisf.args.append("{%s}" % task_config["infile"])
-
-    for valf in soup.find_all("valf"):
-        valf.name = "t"
-        valf.args.append("{%s}" % task_config["outfile"])
-
-    # polygon does not support quote. use an itemize with a single item instead
-    for quote in soup.find_all("quote"):
-        quote.name = "itemize"
-        quote.insert(0, TexCmd("item"))
-
-    # wrapfigure and figure are unsupported. use center instead
-    for fig in soup.find_all(["wrapfigure", "figure"]):
-        fig.name = "center"
-        argc = len(fig.args)  # remove all [h] etc
-        for i in range(argc):
-            fig.args.pop(0)
-
-    # verb is not supported. transform it to polygon's own \t{...} instead
-    for verb in soup.find_all("verb"):
-        verb.name = "t"
-
-    statement = ParsedStatement()
-
-    # figures need to be uploadexd. record all figures and make them available
-    # in the statement return object
-    for graphics in soup.find_all("includegraphics"):
-        for arg in graphics.args:
-            if arg.name == "BraceGroup":
-                resolved = resolve_if_no_extension(arg.string)
-                if resolved is None:
-                    print("Failed to resolve file %s" % arg.string)
-                    continue
-
-                statement.figures.append(resolved)
-                arg.string = get_converted_image_name(resolved)
-
-    # examples need to all have "custom output" and in case of OO/interactive
-    # problems, also "custom input". we need to upload all those to polygon.
-    # record the numbers of examples used
-    for nde in soup.find_all(["nde", "ndex", "ndey"]):
-        statement.examples.append(nde.args[0].string)
-
-    is_ylx = False
-    yl = soup.yl
-    if yl is None:
-        yl = soup.ylx
-        is_ylx = True
+    yl = state.yl
+    is_ylx = yl.name == "ylx"
 
     statement.name = yl.args[1].string
     points = yl.args[3] if is_ylx else yl.args[4]
@@ -166,23 +320,35 @@ def parse_statement(raw_statement: TextIO, task_config: Dict):
 
 
 # takes a stream, returns a string
-# \verb|a| -> \verb{a} everywhere
+# \verb|a| -> \verb{a} everywhere. \verb can't span lines, so this goes line by line.
+# the argument ends at the first occurrence of the delimiter, so a \verb inside it is left
+# alone; braces inside it are escaped to keep the group balanced. \verb* is treated as \verb
 def norm_verb_args(raw_statement: TextIO) -> str:
-    statement_str = raw_statement.read()
-
-    # in theory, this doesn't work with nested verbs
-    # leave it be for the moment
-    verb_ends = [m.end() for m in re.finditer("\\\\verb", statement_str)]
-    statement_mut = list(statement_str)
-    for L in verb_ends:
-        if L >= len(statement_mut):
-            continue
-
-        R = statement_str.find(statement_str[L], L + 1)
-        if R == -1:
+    return "".join(_norm_verb_line(line) for line in raw_statement)
+
+
+def _norm_verb_line(line: str) -> str:
+    if "\\verb" not in line:
+        return line
+
+    pieces = []
+    position = 0
+    while True:
+        match = _VERB.search(line, position)
+        if match is None:
+            break
+
+        left = match.end()
+        right = line.find(line[left], left + 1) if left < len(line) else -1
+        if line[left:left + 1] in ["{", "\n"] or right == -1:
+            # already in braces, or not a complete \verb
+            pieces.append(line[position:left])
+            position = left
             continue
 
-        statement_mut[L] = "{"
-        statement_mut[R] = "}"
+        argument = line[left + 1:right].replace("{", "\\{").replace("}", "\\}")
+        pieces += [line[position:match.start()], "\\verb{", argument, "}"]
+        position = right + 1
 
-    return "".join(statement_mut)
+    pieces.append(line[position:])
+    return "".join(pieces)
@@ -0,0 +1,205 @@
+import json
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from enum import Enum
+
+import requests
+from polygon_api import Polygon
+
+from lib import profiling
+
+DEFAULT_API_URL = "https://polygon.codeforces.com/api/"
+
+# calls that can safely be repeated if we don't know whether the first attempt got through.
+# problem_create, commits and package builds are not among them
+IDEMPOTENT_CALLS = {
+    "problems_list",
+    "problem_info",
+    "problem_update_info",
+    "problem_solutions",
+    "problem_save_solution",
+    "problem_save_test",
+    "problem_save_test_group",
+    "problem_save_file",
+    "problem_save_script",
+    "problem_save_statement",
+    "problem_save_statement_resource",
+    "problem_set_checker",
+    "problem_save_test_stream",
+    "problem_save_file_stream",
+    "problem_save_statement_resource_stream",
+}
+
+# errors that are worth retrying: network problems, and responses that aren't valid JSON,
+# which is what an overloaded server or a proxy error page looks like to polygon_api
+TRANSIENT_ERRORS = (requests.exceptions.RequestException, json.JSONDecodeError)
+
+
+# the seconds a 429 or 503 response asks to wait before trying again, 0 if it doesn't say
+def retry_after(ex: Exception) -> float:
+    response = getattr(ex, "response", None)
+    if response is None:
+        return 0.0
+    try:
+        return float(response.headers.get("Retry-After", 0))
+    except ValueError:
+        return 0.0
+
+
+# rough number of bytes a call uploads: the total length of its string and bytes arguments,
+# including the fields of objects like Statement
+def payload_size(args, kwargs) -> int:
+    size = 0
+    for value in list(args) + list(kwargs.values()):
+        if isinstance(value, (str, bytes)):
+            size += len(value)
+        elif hasattr(value, "fileno"):
+            size += os.fstat(value.fileno()).st_size
+        elif isinstance(value, dict):
+            size += payload_size(value.values(), {})
+        elif hasattr(value, "__dict__") and not isinstance(value, Enum):
+            size += payload_size(vars(value).values(), {})
+    return size
+
+
+# allows at most `rate` calls per second on average, with bursts of up to `burst` calls
+class RateLimiter:
+    def __init__(self, rate: float, burst: int = 1):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = burst
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        if self.rate <= 0:
+            return
+
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+                self._last = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+# keeps connections to Polygon alive and reuses them for later calls, instead of a new
+# connection (and TLS handshake) per call. it stands in for the requests module inside
+# polygon_api, which calls requests.post and the like directly
+class ConnectionPool:
+    def __init__(self, size: int = 10):
+        self.session = requests.Session()
+        self.adapter = requests.adapters.HTTPAdapter(pool_maxsize=size)
+        self.session.mount("http://", self.adapter)
+        self.session.mount("https://", self.adapter)
+        self.requests = 0
+        self._lock = threading.Lock()
+
+    # makes the polygon_api modules that use the requests module use this pool instead.
+    # returns False if there are none, i.e. connections aren't pooled
+    def install(self) -> bool:
+        installed = False
+        for name, module in list(sys.modules.items()):
+            if (name == "polygon_api" or name.startswith("polygon_api.")) \
+                    and (getattr(module, "requests", None) is requests
+                         or isinstance(getattr(module, "requests", None), ConnectionPool)):
+                module.requests = self
+                installed = True
+        return installed
+
+    # a response saying Polygon is overloaded (429 or 5xx) is raised as an HTTPError, so that
+    # ResilientPolygon backs off and retries the call
+    def request(self, method: str, url: str, **kwargs):
+        with self._lock:
+            self.requests += 1
+        response = self.session.request(method, url, **kwargs)
+        if response.status_code == 429 or response.status_code >= 500:
+            response.raise_for_status()
+        return response
+
+    def get(self, url: str, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url: str, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+    # anything else, e.g. requests.exceptions, comes from the requests module
+    def __getattr__(self, name):
+        return getattr(requests, name)
+
+    # the number of connections opened so far
+    @property
+    def connections(self) -> int:
+        pools = self.adapter.poolmanager.pools
+        return sum(pools[key].num_connections for key in pools.keys())
+
+    def print_stats(self):
+        if self.requests == 0:
+            return
+
+        print("Polygon API: %s requests over %s connections." % (self.requests, self.connections))
+
+
+# wraps polygon_api.Polygon: every call goes through the rate limiter (off unless rate_limit
+# is set), and idempotent calls that fail with a transient error are retried with exponential
+# backoff and jitter, waiting at least as long as a 429 response's Retry-After asks.
+# everything else behaves exactly like the wrapped client
+class ResilientPolygon:
+    def __init__(self, polygon: Polygon, max_retries: int = 5, base_delay: float = 1.0, max_delay: float = 30.0,
+                 rate_limit: float = 0.0, pool: ConnectionPool = None):
+        self.polygon = polygon
+        self.pool = pool
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.rate_limiter = RateLimiter(rate_limit, burst=max(int(rate_limit), 1))
+        # retries by endpoint
+        self.retries = Counter()
+        self._retries_lock = threading.Lock()
+
+    def __getattr__(self, name):
+        attr = getattr(self.polygon, name)
+        if not callable(attr):
+            return attr
+
+        def call(*args, **kwargs):
+            # raw requests are named by their API method, e.g. problem.buildPackage
+            endpoint = args[0] if name == "_request_ok_or_raise" and len(args) > 0 else name
+            attempt = 0
+            while True:
+                self.rate_limiter.acquire()
+                try:
+                    with profiling.span("api", endpoint, bytes_sent=payload_size(args, kwargs), attempt=attempt):
+                        return attr(*args, **kwargs)
+                except TRANSIENT_ERRORS as ex:
+                    if name not in IDEMPOTENT_CALLS or attempt >= self.max_retries:
+                        raise
+
+                    delay = min(self.max_delay, self.base_delay * 2 ** attempt)
+                    delay = max(random.uniform(delay / 2, delay), retry_after(ex))
+                    attempt += 1
+                    with self._retries_lock:
+                        self.retries[endpoint] += 1
+                    print("%s failed (%s), retrying in %.1f s (attempt %s of %s)..."
+                          % (endpoint, type(ex).__name__, delay, attempt, self.max_retries))
+                    time.sleep(delay)
+
+        return call
+
+    def print_stats(self):
+        if self.pool is not None:
+            self.pool.print_stats()
+        if len(self.retries) == 0:
+            return
+
+        print("Retried Polygon API calls:")
+        for endpoint, count in sorted(self.retries.items()):
+            print("  %s: %s" % (endpoint, count))
@@ -0,0 +1,133 @@
+import cProfile
+import json
+import os
+import subprocess
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from pathlib import Path
+
+
+# timings of an export: top-level phases, Polygon API calls, subprocesses and statement parsing.
+# each event has a kind ("phase", "api", "subprocess", "parse"), a name, the task it belongs to,
+# start time relative to the start of the trace, duration and kind-specific details
+class Trace:
+    def __init__(self, start: float = None):
+        self.start = start if start is not None else time.monotonic()
+        self.events = []
+        self._lock = threading.Lock()
+
+    def record(self, kind: str, name: str, start: float, duration: float, **details):
+        event = {
+            "kind": kind,
+            "name": name,
+            "task": Path(os.getcwd()).name,
+            "start": round(start - self.start, 6),
+            "duration": round(duration, 6),
+        }
+        event.update(details)
+        with self._lock:
+            self.events.append(event)
+
+    def extend(self, events: list):
+        with self._lock:
+            self.events.extend(events)
+
+    def summary(self) -> dict:
+        totals = defaultdict(lambda: {"count": 0, "total": 0.0, "max": 0.0})
+        with self._lock:
+            for event in self.events:
+                total = totals["%s:%s" % (event["kind"], event["name"])]
+                total["count"] += 1
+                total["total"] = round(total["total"] + event["duration"], 6)
+                total["max"] = max(total["max"], event["duration"])
+                if "bytes_sent" in event:
+                    total["bytes_sent"] = total.get("bytes_sent", 0) + event["bytes_sent"]
+        return dict(totals)
+
+    def write(self, path: str):
+        with self._lock:
+            events = list(self.events)
+        with open(path, "w") as trace_stream:
+            json.dump({"events": events, "summary": self.summary()}, trace_stream, indent=2)
+
+
+# the trace of this process, None if tracing is off
+_trace: Trace = None
+# directory for per-phase cProfile dumps, None if profiling is off
+_profile_dir: str = None
+
+
+def start_trace(profile_dir: str = None):
+    global _trace, _profile_dir
+    _trace = Trace()
+    _profile_dir = profile_dir
+    if profile_dir is not None:
+        Path(profile_dir).mkdir(parents=True, exist_ok=True)
+
+
+def write_trace(path: str):
+    if _trace is not None:
+        _trace.write(path)
+        print("Wrote timing report to %s." % path)
+
+
+def record(kind: str, name: str, start: float, duration: float, **details):
+    if _trace is not None:
+        _trace.record(kind, name, start, duration, **details)
+
+
+# fn(*args) for running in a worker process: a forked worker records into its own copy of the
+# trace, which the parent never sees, so the events are returned along with the result.
+# submit this to the executor and get the result with traced_result
+def call_traced(fn, *args):
+    global _trace
+    if _trace is None:
+        return fn(*args), []
+    # the monotonic clock is shared by all processes, so the events line up with the parent's
+    _trace = Trace(_trace.start)
+    return fn(*args), _trace.events
+
+
+# the result of a call_traced future, with the worker's events added to this process's trace
+def traced_result(future):
+    result, events = future.result()
+    if _trace is not None:
+        _trace.extend(events)
+    return result
+
+
+# times the body as an event; details can be added to the yielded dict
+@contextmanager
+def span(kind: str, name: str, **details):
+    start = time.monotonic()
+    try:
+        yield details
+    finally:
+        record(kind, name, start, time.monotonic() - start, **details)
+
+
+# times a top-level phase. with profiling on, the calling thread is also profiled into
+# [profile dir]/[task]-[phase].prof (work done in other threads or processes isn't included)
+@contextmanager
+def phase_span(name: str):
+    profiler = None
+    if _profile_dir is not None:
+        profiler = cProfile.Profile()
+        profiler.enable()
+    try:
+        with span("phase", name):
+            yield
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(os.path.join(_profile_dir, "%s-%s.prof" % (Path(os.getcwd()).name, name)))
+
+
+# subprocess.run, recorded as an event named after the program
+def run(args, **kwargs) -> subprocess.CompletedProcess:
+    with span("subprocess", os.path.basename(str(args[0])), args=[str(arg) for arg in args]) as details:
+        result = subprocess.run(args, **kwargs)
+        details["returncode"] = result.returncode
+        return result
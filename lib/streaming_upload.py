@@ -0,0 +1,137 @@
+import hashlib
+import os
+import random
+import string
+import time
+import uuid
+from typing import BinaryIO, Dict, Iterator, Optional, Union
+
+import requests
+from polygon_api import Polygon, PolygonRequestFailedException
+
+# size of the blocks in which uploaded files are read, hashed and sent
+DEFAULT_UPLOAD_BUFFER_SIZE = 1 << 20
+
+# a parameter value: text, raw bytes, or a binary file that is read while the request is sent
+Value = Union[str, bytes, BinaryIO]
+
+
+def _camel_case(name: str) -> str:
+    first, *rest = name.split("_")
+    return first + "".join(word.capitalize() for word in rest)
+
+
+def _value_size(value: Value) -> int:
+    if isinstance(value, str):
+        return len(value.encode("utf-8"))
+    if isinstance(value, bytes):
+        return len(value)
+    return os.fstat(value.fileno()).st_size
+
+
+# parameters as Polygon expects them: booleans in lower case, numbers as text
+def _format(value):
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, (int, float)):
+        return str(value)
+    return value
+
+
+# the value in blocks of at most buffer_size bytes, files from the start
+def _value_blocks(value: Value, buffer_size: int) -> Iterator[bytes]:
+    if isinstance(value, str):
+        yield value.encode("utf-8")
+    elif isinstance(value, bytes):
+        yield value
+    else:
+        value.seek(0)
+        yield from iter(lambda: value.read(buffer_size), b"")
+
+
+# a multipart/form-data body that reads files only as it's sent. requests sends an iterable
+# with a length block by block, with a Content-Length header
+class _MultipartBody:
+    def __init__(self, params: Dict[str, Value], buffer_size: int):
+        self.boundary = uuid.uuid4().hex
+        self.params = params
+        self.buffer_size = buffer_size
+        self.content_type = "multipart/form-data; boundary=%s" % self.boundary
+
+    def _header(self, name: str, value: Value) -> bytes:
+        filename = '; filename="%s"' % name if not isinstance(value, str) else ""
+        return ('--%s\r\nContent-Disposition: form-data; name="%s"%s\r\n\r\n'
+                % (self.boundary, name, filename)).encode("utf-8")
+
+    def _footer(self) -> bytes:
+        return ("--%s--\r\n" % self.boundary).encode("ascii")
+
+    def __len__(self) -> int:
+        return sum(len(self._header(name, value)) + _value_size(value) + 2 for name, value in self.params.items()) \
+               + len(self._footer())
+
+    def __iter__(self) -> Iterator[bytes]:
+        for name, value in self.params.items():
+            yield self._header(name, value)
+            yield from _value_blocks(value, self.buffer_size)
+            yield b"\r\n"
+        yield self._footer()
+
+
+# wraps polygon_api.Polygon with upload methods that send files as raw bytes, without reading
+# them into memory: the request signature is hashed and the body is sent block by block, so
+# memory use is bounded by buffer_size rather than by the largest file. polygon_api needs the
+# content in memory, as text. everything else goes to the wrapped client
+class StreamingPolygon:
+    # session can be anything with requests.Session's post, e.g. a ConnectionPool
+    def __init__(self, polygon: Polygon, api_url: str, key: str, secret: str, session=None,
+                 buffer_size: int = DEFAULT_UPLOAD_BUFFER_SIZE):
+        self.polygon = polygon
+        self.api_url = api_url
+        self.key = key
+        self.secret = secret
+        self.session = session or requests.Session()
+        self.buffer_size = buffer_size
+
+    def __getattr__(self, name):
+        return getattr(self.polygon, name)
+
+    # Polygon's signature: a random prefix and the SHA-512 of the prefix, method, sorted
+    # parameters and secret
+    def _signature(self, method: str, params: Dict[str, Value]) -> str:
+        prefix = "".join(random.choice(string.ascii_lowercase + string.digits) for _ in range(6))
+        hasher = hashlib.sha512(("%s/%s?" % (prefix, method)).encode("utf-8"))
+        for i, name in enumerate(sorted(params)):
+            hasher.update(("%s%s=" % ("&" if i > 0 else "", name)).encode("utf-8"))
+            for block in _value_blocks(params[name], self.buffer_size):
+                hasher.update(block)
+        hasher.update(("#%s" % self.secret).encode("utf-8"))
+        return prefix + hasher.hexdigest()
+
+    def _call(self, method: str, **params: Optional[Value]):
+        params = {_camel_case(name): value for name, value in params.items() if value is not None}
+        params["apiKey"] = self.key
+        params["time"] = str(int(time.time()))
+        params["apiSig"] = self._signature(method, params)
+
+        body = _MultipartBody(params, self.buffer_size)
+        response = self.session.post(self.api_url + method, data=body, headers={"Content-Type": body.content_type})
+        result = response.json()
+        if result["status"] != "OK":
+            raise PolygonRequestFailedException(result["comment"])
+        return result.get("result")
+
+    # problem_save_test, with the input (and example input and output) as binary files
+    def problem_save_test_stream(self, problem_id, testset: str, test_index: int, test_input: Optional[Value],
+                                 **kwargs):
+        params = {name: _format(value) for name, value in kwargs.items()}
+        self._call("problem.saveTest", problem_id=str(problem_id), testset=testset, test_index=str(test_index),
+                   test_input=test_input, **params)
+
+    def problem_save_file_stream(self, problem_id, file_type: str, name: str, file: Value, source_type: str = None):
+        self._call("problem.saveFile", problem_id=str(problem_id), type=file_type, name=name, file=file,
+                   source_type=source_type)
+
+    def problem_save_statement_resource_stream(self, problem_id, name: str, file: Value):
+        self._call("problem.saveStatementResource", problem_id=str(problem_id), name=name, file=file)
+
@@ -1,11 +1,29 @@
+import fcntl
 import os.path
+import queue
+import re
 import shutil
 import subprocess
 import traceback
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import asdict, dataclass, field
 from enum import Enum
 from pathlib import Path
+from typing import Dict, List, Optional, Tuple
 
+from lib import profiling
+from lib.build_cache import compile_cached, testlib_pch_flags
+from lib.checker_cache import check_both_ways
+from lib.cli import ExportAborted, answer, has_answer
+from lib.compare_output import compare_outputs
+from lib.export_basic_info import effective_time_limit, polygon_memory_limit
 from lib.export_context import ExportContext
+from lib.genfile import TestGroup
+from lib.manifest import content_hash, file_hash, stream_hash
+from lib.measured_run import RunMeasurement, run_measured
+
+# linux ioctl for cloning a file's extents (copy-on-write copy)
+_FICLONE = 0x40049409
 
 
 class RunResult(Enum):
@@ -15,7 +33,8 @@ class RunResult(Enum):
     WRONG_ANSWER = 3,
     RUNTIME_ERROR = 4,
     NOT_RUN = 5,
-    INCONSISTENT = 6
+    INCONSISTENT = 6,
+    MEMORY_LIMIT_EXCEEDED = 7
 
 
 class Language(Enum):
@@ -25,6 +44,37 @@ class Language(Enum):
     C = 3
 
 
+# how solutions are compiled for validation
+SOLUTION_COMPILERS = {
+    Language.CPP: ("g++", ["-O2"]),
+    Language.C: ("gcc", ["-O2", "-lm"]),
+}
+
+
+# outcome of running the solution (and the checker) on a single test
+@dataclass
+class TestRun:
+    group: TestGroup
+    test: str
+    verdict: RunResult = RunResult.NOT_RUN
+    messages: List[str] = field(default_factory=list)
+    # resources used by the solution, None if it wasn't run
+    measurement: RunMeasurement = None
+
+    # the verdict this test contributes to the overall result; examples are tolerated
+    @property
+    def effective_verdict(self) -> RunResult:
+        if self.verdict == RunResult.ACCEPTED and self.group.points == 0:
+            return RunResult.EXACT_MATCH
+        if self.verdict == RunResult.WRONG_ANSWER and self.group.points == 0:
+            return RunResult.EXACT_MATCH
+        return self.verdict
+
+    @property
+    def is_failure(self) -> bool:
+        return self.effective_verdict not in [RunResult.EXACT_MATCH, RunResult.ACCEPTED]
+
+
 def validate_solution(model_solution_path: str, ctx: ExportContext) -> RunResult:
     # TODO: checker integration
     assert not ctx.is_interactive
@@ -32,154 +82,384 @@ def validate_solution(model_solution_path: str, ctx: ExportContext) -> RunResult
 
     working_dir = "polygon/working"
     Path(working_dir).mkdir(parents=True, exist_ok=True)
-    _, ext = os.path.splitext(model_solution_path)
-    if ext == ".cpp":
-        subprocess.run(["g++", "-O2", model_solution_path, "-o", os.path.join(working_dir, "sol")],
-                       check=True)
-        sol_filename = "sol"
-        language = Language.CPP
-    elif ext == ".c":
-        subprocess.run(["gcc", "-O2", model_solution_path, "-o", os.path.join(working_dir, "sol"), "-lm"],
-                       check=True)
-        sol_filename = "sol"
-        language = Language.C
-    elif ext == ".py":
-        shutil.copyfile(model_solution_path, os.path.join(working_dir, "sol.py"))
-        sol_filename = "sol.py"
-        language = Language.PY2
-    else:
-        print("Solution files with extension %s are not supported." % ext)
+    language = solution_language(model_solution_path, ctx)
+    if language is None:
         return RunResult.NOT_RUN
 
-    if language == Language.PY2:
-        print("Which version of Python is this?")
-        while True:
-            response = input("Select 2 or 3: ")
-            if response == "3":
-                language = Language.PY3
-                break
-            elif response == "2":
-                language = Language.PY2
-                break
-            else:
-                print("Unknown response.")
+    args = build_solution(model_solution_path, language, working_dir)
 
     if ctx.has_custom_checker and ctx.custom_checker_path is not None:
         print("Compiling checker...")
-        subprocess.run(["g++", "-O2", os.path.join("polygon/checker", ctx.custom_checker_path),
-                        "-o", os.path.join(working_dir, "check")],
-                       check=True)
+        checker_source_path = os.path.join("polygon/checker", ctx.custom_checker_path)
+        checker_flags = ["-O2"]
+        if ctx.testlib_path is not None and uses_testlib(checker_source_path):
+            checker_flags += testlib_pch_flags(ctx.testlib_path, "g++", checker_flags)
+        compile_cached("g++", checker_flags, checker_source_path, os.path.join(working_dir, "check"))
 
-    overall_verdict = RunResult.EXACT_MATCH
-    for group in ctx.gen_file:
-        for test in group.files:
-            infile = ctx.task_config["infile"]
-            input_path = os.path.join("input", test)
-            if len(infile) != 0:
-                shutil.copyfile(input_path, os.path.join(working_dir, infile))
-                proc_input = None
-            else:
-                with open(input_path) as infile_stream:
-                    proc_input = infile_stream.read()
-
-            print("Running solution on test %s..." % test)
-            args = []
-            if language == Language.PY3:
-                args.append("pypy3")
-                args.append(sol_filename)
-            elif language == Language.PY2:
-                args.append("python2")
-                args.append(sol_filename)
-            else:
-                args.append("./" + sol_filename)
+    runs = [TestRun(group, test) for group in ctx.gen_file for test in group.files]
+    workers = max(ctx.validation_workers, 1)
 
+    # tests this solution passed before are only run again if something that affects the verdict changed
+    keys = validation_keys(model_solution_path, language, runs, ctx)
+    stale_runs = [test_run for test_run in runs
+                  if not restore_test_run(test_run, ctx.validation_ledger.get(keys[test_run.test]))]
+    if len(stale_runs) < len(runs):
+        print("%s of %s tests passed with this solution before and are unchanged, not running them again." %
+              (len(runs) - len(stale_runs), len(runs)))
+
+    # every worker gets its own directory so that infile/outfile names don't collide
+    run_dirs = queue.Queue()
+    for i in range(workers):
+        run_dir = working_dir if workers == 1 else os.path.join(working_dir, "run%s" % i)
+        Path(run_dir).mkdir(parents=True, exist_ok=True)
+        run_dirs.put(run_dir)
+
+    def run_in_free_dir(test_run: TestRun) -> TestRun:
+        run_dir = run_dirs.get()
+        try:
+            run_test(test_run, args, run_dir, ctx)
+        finally:
+            run_dirs.put(run_dir)
+        if not test_run.is_failure:
+            ctx.validation_ledger.record(keys[test_run.test], {
+                "verdict": test_run.verdict.name,
+                "messages": test_run.messages,
+                "measurement": asdict(test_run.measurement),
+            })
+        return test_run
+
+    try:
+        if workers == 1:
+            for test_run in stale_runs:
+                print("Running solution on test %s..." % test_run.test)
+                run_in_free_dir(test_run)
+                report_test_run(test_run)
+                if test_run.is_failure and not ctx.validation_keep_going:
+                    return test_run.effective_verdict
+        else:
+            print("Running solution on %s tests with %s workers..." % (len(stale_runs), workers))
+            # longest inputs first, so that a slow test doesn't start last and hold up the others
+            by_size = sorted(stale_runs, key=lambda r: os.path.getsize(os.path.join("input", r.test)), reverse=True)
+            order = {test_run.test: i for i, test_run in enumerate(runs)}
+            executor = ThreadPoolExecutor(max_workers=workers)
+            futures = {executor.submit(run_in_free_dir, test_run): order[test_run.test] for test_run in by_size}
+            # like a serial run, stop at the first failing test in gen/GEN order: tests after a
+            # failure are cancelled, but the ones before it still run, as they may fail too
+            first_failure = len(runs)
             try:
-                result = subprocess.run(args,
-                                        text=True,
-                                        input=proc_input,
-                                        capture_output=True,
-                                        timeout=ctx.task_config["time_limit"],
-                                        cwd=working_dir)
-                if result.returncode != 0:
-                    print("Got runtime error.")
-                    return RunResult.RUNTIME_ERROR
-            except subprocess.TimeoutExpired:
-                print("Time limit exceeded.")
-                return RunResult.TIME_LIMIT_EXCEEDED
-
-            expected_output_path = os.path.join("output", test.replace("input", "output"))
-
-            outfile = ctx.task_config["outfile"]
-            if len(outfile) != 0:
-                actual_output_path = os.path.join(working_dir, outfile)
-            else:
-                actual_output_path = os.path.join(working_dir, "out.txt")
-                with open(actual_output_path, "w") as actual_output_stream:
-                    actual_output_stream.write(result.stdout)
+                for future in as_completed(futures):
+                    if future.cancelled():
+                        continue
+                    test_run = future.result()
+                    print("Finished test %s." % test_run.test)
+                    report_test_run(test_run)
+                    if test_run.is_failure and not ctx.validation_keep_going and futures[future] < first_failure:
+                        first_failure = futures[future]
+                        for other, index in futures.items():
+                            if index > first_failure:
+                                other.cancel()
+            finally:
+                executor.shutdown(wait=True, cancel_futures=True)
+            if first_failure < len(runs):
+                print("The first failing test is %s:" % runs[first_failure].test)
+                report_test_run(runs[first_failure])
+    finally:
+        ctx.validation_ledger.save()
+        report_resources(runs, ctx)
 
-            diff = subprocess.run(["diff", "--ignore-trailing-space", "--strip-trailing-cr",
-                                   actual_output_path, expected_output_path])
+    if ctx.validation_keep_going:
+        print("Verdicts for all tests:")
+        for test_run in runs:
+            print("%s: %s" % (test_run.test, test_run.verdict.name))
 
-            if diff.returncode == 0:
-                verdict = RunResult.EXACT_MATCH
-            else:
-                verdict = RunResult.WRONG_ANSWER
-
-            if ctx.has_custom_checker:
-                if ctx.custom_checker_path is not None:
-                    check = subprocess.run(["polygon/working/check",
-                                            os.path.join("input", test),
-                                            actual_output_path,
-                                            expected_output_path],
-                                           text=True,
-                                           capture_output=True)
-
-                    checker_ok = check.returncode == 0 or \
-                                 (check.returncode == 7 and check.stderr.startswith("points 100"))
-
-                    if checker_ok:
-                        if verdict == RunResult.EXACT_MATCH:
-                            pass
-                        if verdict == RunResult.WRONG_ANSWER:
-                            verdict = RunResult.ACCEPTED
-                    else:
-                        if verdict == RunResult.EXACT_MATCH:
-                            print("Conflict: output matches input exactly but checker returns WA.")
-                            print("Are you sure that the checker is correct?")
-                            return RunResult.INCONSISTENT
-                        else:
-                            pass
-
-                    reverse_check = subprocess.run(["polygon/working/check",
-                                                    os.path.join("input", test),
-                                                    expected_output_path,
-                                                    actual_output_path],
-                                                   text=True,
-                                                   capture_output=True)
-
-                    reverse_checker_ok = reverse_check.returncode == 0 or \
-                                         (reverse_check.returncode == 7 and reverse_check.stderr.startswith(
-                                             "points 100"))
-
-                    if checker_ok and not reverse_checker_ok:
-                        print("""Checker returns OK but not with reversed output. Are you sure output files 
-are not 'hints'?""")
-                        return RunResult.INCONSISTENT
-                else:
-                    print("Warning: can't run checker because you skipped that step.")
+    # the same verdict a serial run stopping at the first failure would give
+    overall_verdict = RunResult.EXACT_MATCH
+    for test_run in runs:
+        if test_run.is_failure:
+            return test_run.effective_verdict
+        if test_run.effective_verdict == RunResult.ACCEPTED:
+            overall_verdict = RunResult.ACCEPTED
 
-            if verdict == RunResult.EXACT_MATCH:
-                print("OK")
-            elif verdict == RunResult.ACCEPTED:
-                if group.points == 0:
-                    print("Output file doesn't match output generated by solution exactly, tolerating because example")
-                else:
-                    print("Output file doesn't match output generated by solution exactly, but still passes.")
-                    overall_verdict = RunResult.ACCEPTED
+    return overall_verdict
+
+
+# ledger keys of the runs by test. a verdict depends on the solution and the test, but also on
+# the checker, the limits and the I/O file names
+def validation_keys(model_solution_path: str, language: Language, runs: List[TestRun],
+                    ctx: ExportContext) -> Dict[str, str]:
+    checker_digest = None
+    if ctx.has_custom_checker and ctx.custom_checker_path is not None:
+        checker_digest = file_hash(os.path.join("polygon/checker", ctx.custom_checker_path))
+    common = [file_hash(model_solution_path), language.name, ctx.has_custom_checker, checker_digest,
+              effective_time_limit(ctx), polygon_memory_limit(ctx.task_config), ctx.validation_memory_cap,
+              ctx.task_config["infile"], ctx.task_config["outfile"]]
+
+    keys = {}
+    for test_run in runs:
+        with open(os.path.join("input", test_run.test), "rb") as input_stream, \
+                open(expected_output_path(test_run.test), "rb") as output_stream:
+            keys[test_run.test] = content_hash(*common, stream_hash(input_stream), stream_hash(output_stream))
+    return keys
+
+
+# fills in test_run from a ledger entry, if there is one
+def restore_test_run(test_run: TestRun, entry: Optional[dict]) -> bool:
+    if entry is None:
+        return False
+
+    test_run.verdict = RunResult[entry["verdict"]]
+    test_run.messages = entry["messages"]
+    test_run.measurement = RunMeasurement(**entry["measurement"])
+    return True
+
+
+def expected_output_path(test: str) -> str:
+    return os.path.join("output", test.replace("input", "output"))
+
+
+# the language of the solution at model_solution_path, None if it isn't supported. asks which
+# version of Python a Python solution is, once per export
+def solution_language(model_solution_path: str, ctx: ExportContext) -> Optional[Language]:
+    _, ext = os.path.splitext(model_solution_path)
+    if ext == ".cpp":
+        return Language.CPP
+    elif ext == ".c":
+        return Language.C
+    elif ext != ".py":
+        print("Solution files with extension %s are not supported." % ext)
+        return None
+
+    if ctx.python_version is not None:
+        return ctx.python_version
+
+    if not has_answer("python_version"):
+        versions = compiling_python_versions(model_solution_path)
+        if len(versions) == 1:
+            print("%s only compiles as %s, using it." % (model_solution_path, versions[0].name))
+            ctx.python_version = versions[0]
+            return ctx.python_version
+
+    print("Which version of Python is this?")
+    while True:
+        response = str(answer("python_version", lambda: input("Select 2 or 3: ")))
+        if response == "3":
+            ctx.python_version = Language.PY3
+            return ctx.python_version
+        elif response == "2":
+            ctx.python_version = Language.PY2
+            return ctx.python_version
+        elif has_answer("python_version"):
+            raise ExportAborted("python_version in the answers file must be 2 or 3")
+        else:
+            print("Unknown response.")
+
+
+# the Python versions the source at path compiles under. Python 2 is only tried if python2 is installed
+def compiling_python_versions(path: str) -> List[Language]:
+    with open(path, "rb") as source_stream:
+        source = source_stream.read()
+
+    versions = []
+    try:
+        compile(source, path, "exec")
+        versions.append(Language.PY3)
+    except (SyntaxError, ValueError):
+        pass
+
+    if shutil.which("python2") is not None:
+        check = profiling.run(["python2", "-c", "import sys; compile(open(sys.argv[1]).read(), sys.argv[1], 'exec')",
+                               path], stderr=subprocess.DEVNULL)
+        if check.returncode == 0:
+            versions.append(Language.PY2)
+    return versions
+
+
+# compiles (or copies) the solution into working_dir and returns the command that runs it.
+# compilers maps compiled languages to (compiler, flags)
+def build_solution(model_solution_path: str, language: Language, working_dir: str,
+                   compilers: Dict[Language, Tuple[str, List[str]]] = None) -> List[str]:
+    compilers = compilers or SOLUTION_COMPILERS
+    if language in compilers:
+        compiler, flags = compilers[language]
+        compile_cached(compiler, flags, model_solution_path, os.path.join(working_dir, "sol"))
+        return [os.path.abspath(os.path.join(working_dir, "sol"))]
+
+    sol_path = os.path.abspath(os.path.join(working_dir, "sol.py"))
+    shutil.copyfile(model_solution_path, sol_path)
+    if language == Language.PY3:
+        return ["pypy3", sol_path]
+    else:
+        return ["python2", sol_path]
+
+
+def uses_testlib(source_path: str) -> bool:
+    with open(source_path, errors="replace") as source_stream:
+        return re.search(r'#\s*include\s*[<"]testlib\.h[>"]', source_stream.read()) is not None
+
+
+def report_test_run(test_run: TestRun):
+    for message in test_run.messages:
+        print(message)
+
+    if test_run.verdict == RunResult.EXACT_MATCH:
+        print("OK")
+    elif test_run.verdict == RunResult.ACCEPTED:
+        if test_run.group.points == 0:
+            print("Output file doesn't match output generated by solution exactly, tolerating because example")
+        else:
+            print("Output file doesn't match output generated by solution exactly, but still passes.")
+    elif test_run.verdict == RunResult.WRONG_ANSWER:
+        if test_run.group.points == 0:
+            print("Output file is wrong, tolerating because example, but please check!")
+
+
+# per group, the most time and memory any test took, against the limits Polygon will get.
+# tests using over half of the time limit or more than the memory limit are listed
+def report_resources(runs: List[TestRun], ctx: ExportContext):
+    measured = [test_run for test_run in runs if test_run.measurement is not None]
+    if len(measured) == 0:
+        return
+
+    time_limit = effective_time_limit(ctx)
+    memory_limit = polygon_memory_limit(ctx.task_config)
+    print("Resources used by the solution (Polygon limits: %s ms, %s MB):" % (time_limit, memory_limit))
+    heavy = []
+    for group in dict.fromkeys(test_run.group.name for test_run in measured):
+        group_runs = [test_run for test_run in measured if test_run.group.name == group]
+        slowest = max(group_runs, key=lambda r: r.measurement.cpu_time)
+        largest = max(group_runs, key=lambda r: r.measurement.peak_rss_kb)
+        print("Group %s (%s tests): CPU %s ms (%s), wall %s ms, memory %s MB (%s)" %
+              (group, len(group_runs),
+               int(slowest.measurement.cpu_time * 1000), slowest.test,
+               int(max(r.measurement.wall_time for r in group_runs) * 1000),
+               largest.measurement.peak_rss_kb // 1024, largest.test))
+        for test_run in group_runs:
+            if test_run.measurement.cpu_time * 1000 > time_limit / 2 \
+                    or test_run.measurement.peak_rss_kb > memory_limit * 1024:
+                heavy.append(test_run)
+
+    for test_run in heavy:
+        print("Warning: test %s used %s ms of CPU time and %s MB of memory." %
+              (test_run.test, int(test_run.measurement.cpu_time * 1000), test_run.measurement.peak_rss_kb // 1024))
+
+
+# puts a copy of source at target without reading it into memory: a reflink where the
+# filesystem supports it, otherwise an in-kernel copy. not a hardlink, as the solution
+# could then overwrite the original test
+def stage_file(source: str, target: str):
+    if os.path.exists(target):
+        os.remove(target)
+
+    with open(source, "rb") as source_stream, open(target, "wb") as target_stream:
+        try:
+            fcntl.ioctl(target_stream.fileno(), _FICLONE, source_stream.fileno())
+            return
+        except OSError:
+            pass
+
+    shutil.copyfile(source, target)
+
+
+# runs the solution on a single test in run_dir and measures it. fills in the verdict if the
+# run exceeded a limit or crashed; otherwise returns the path of its output for checking
+def measure_test(test_run: TestRun, args: List[str], run_dir: str, ctx: ExportContext) -> Optional[str]:
+    input_path = os.path.join("input", test_run.test)
+
+    infile = ctx.task_config["infile"]
+    if len(infile) != 0:
+        stage_file(input_path, os.path.join(run_dir, infile))
+        stdin_path = os.devnull
+    else:
+        stdin_path = input_path
+
+    outfile = ctx.task_config["outfile"]
+    if len(outfile) != 0:
+        actual_output_path = os.path.join(run_dir, outfile)
+        # don't compare against the output of the previous test if this run writes nothing
+        if os.path.exists(actual_output_path):
+            os.remove(actual_output_path)
+        stdout_path = os.devnull
+    else:
+        actual_output_path = os.path.join(run_dir, "out.txt")
+        stdout_path = actual_output_path
+
+    # the solution reads and writes the files directly, so test size doesn't affect our memory use
+    time_limit = effective_time_limit(ctx) / 1000  # in seconds
+    memory_limit = polygon_memory_limit(ctx.task_config)
+    with open(stdin_path, "rb") as stdin_stream, open(stdout_path, "wb") as stdout_stream:
+        test_run.measurement = run_measured(args,
+                                            stdin=stdin_stream,
+                                            stdout=stdout_stream,
+                                            cwd=run_dir,
+                                            timeout=time_limit,
+                                            memory_limit_mb=memory_limit if ctx.validation_memory_cap else None)
+
+    measurement = test_run.measurement
+    if measurement.timed_out or measurement.cpu_time > time_limit:
+        test_run.messages.append("Time limit exceeded.")
+        test_run.verdict = RunResult.TIME_LIMIT_EXCEEDED
+        return None
+    # the sampled peak never overstates what the solution used, so this can't be a false alarm
+    if measurement.peak_rss_kb > memory_limit * 1024:
+        test_run.messages.append("Memory limit exceeded (%s MB)." % (measurement.peak_rss_kb // 1024))
+        test_run.verdict = RunResult.MEMORY_LIMIT_EXCEEDED
+        return None
+    if measurement.returncode != 0:
+        test_run.messages.append("Got runtime error.")
+        if ctx.validation_memory_cap:
+            # allocations beyond the cap fail, which usually crashes the solution
+            test_run.messages.append("Its memory was capped at %s MB, it may have run out of memory." % memory_limit)
+        test_run.verdict = RunResult.RUNTIME_ERROR
+        return None
+    return actual_output_path
+
+
+# runs the solution on a single test in run_dir and fills in the verdict. doesn't print
+# anything itself, as runs in different directories may be happening concurrently
+def run_test(test_run: TestRun, args: List[str], run_dir: str, ctx: ExportContext):
+    test = test_run.test
+    answer_path = expected_output_path(test)
+    outfile = ctx.task_config["outfile"]
+    actual_output_path = measure_test(test_run, args, run_dir, ctx)
+    if actual_output_path is None:
+        return
+
+    difference = compare_outputs(actual_output_path, answer_path) \
+        if os.path.exists(actual_output_path) else "Output file %s was not created." % outfile
+
+    if difference is None:
+        verdict = RunResult.EXACT_MATCH
+    else:
+        verdict = RunResult.WRONG_ANSWER
+        test_run.messages.append(str(difference))
+
+    if ctx.has_custom_checker:
+        if ctx.custom_checker_path is not None:
+            checker_ok, reverse_checker_ok = check_both_ways("polygon/working/check",
+                                                             os.path.join("input", test),
+                                                             actual_output_path,
+                                                             answer_path)
+
+            if checker_ok:
+                if verdict == RunResult.EXACT_MATCH:
+                    pass
+                if verdict == RunResult.WRONG_ANSWER:
+                    verdict = RunResult.ACCEPTED
             else:
-                if group.points == 0:
-                    print("Output file is wrong, tolerating because example, but please check!")
+                if verdict == RunResult.EXACT_MATCH:
+                    test_run.messages.append("Conflict: output matches input exactly but checker returns WA.")
+                    test_run.messages.append("Are you sure that the checker is correct?")
+                    test_run.verdict = RunResult.INCONSISTENT
+                    return
                 else:
-                    return RunResult.WRONG_ANSWER
+                    pass
 
-    return overall_verdict
+            if checker_ok and not reverse_checker_ok:
+                test_run.messages.append("""Checker returns OK but not with reversed output. Are you sure output files 
+are not 'hints'?""")
+                test_run.verdict = RunResult.INCONSISTENT
+                return
+        else:
+            test_run.messages.append("Warning: can't run checker because you skipped that step.")
+
+    test_run.verdict = verdict
@@ -0,0 +1,41 @@
+import json
+import os
+import threading
+from pathlib import Path
+
+VALIDATION_LEDGER_PATH = "polygon/validation-ledger.json"
+
+
+# remembers the tests a solution passed, so that validating the same solution again only
+# runs it on tests that changed. keys are content hashes of the solution, its language, the
+# test and whatever else decides the verdict (see validate_solution); entries hold the
+# verdict, messages and measurement of the run
+class ValidationLedger:
+    def __init__(self, entries: dict = None, path: str = VALIDATION_LEDGER_PATH):
+        self.entries = entries if entries is not None else {}
+        self.path = path
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def load(path: str = VALIDATION_LEDGER_PATH) -> "ValidationLedger":
+        if os.path.exists(path):
+            with open(path) as ledger_stream:
+                return ValidationLedger(json.load(ledger_stream), path)
+        return ValidationLedger(path=path)
+
+    def get(self, key: str) -> dict:
+        with self._lock:
+            return self.entries.get(key)
+
+    def record(self, key: str, entry: dict):
+        with self._lock:
+            self.entries[key] = entry
+
+    # written once per validation rather than per test, as there can be thousands of tests
+    def save(self):
+        with self._lock:
+            Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w") as ledger_stream:
+                json.dump(self.entries, ledger_stream, indent=2, sort_keys=True)
+            os.replace(tmp_path, self.path)